@@ -3,14 +3,15 @@ This script scrapes the manually downloaded HTML files to extract event data int
 """
 
 from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 from bs4 import BeautifulSoup
 import json
 import os
 import pytz
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.config import INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.influx import get_client
 
 coords = [53.488056, -2.243889]
 
@@ -27,9 +28,8 @@ def format_date_to_string(date_str):
 
 def write_to_influxdb(data_points):
     try:
-        with InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG) as client:
-            write_api = client.write_api(write_options=SYNCHRONOUS)
-            write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
+        write_api = get_client().write_api(write_options=SYNCHRONOUS)
+        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
     except Exception as e:
         print(f"Error writing to InfluxDB: {e}")
 
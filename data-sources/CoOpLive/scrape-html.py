@@ -3,14 +3,15 @@ This script scrapes the manually downloaded HTML files to extract event data int
 """
 
 from datetime import datetime
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 from bs4 import BeautifulSoup
 import json
 import os
 import pytz
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.config import INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.influx import get_client
 
 coords = [53.486389, -2.199722]
 cutoff_date = datetime.strptime("2024-05-14", "%Y-%m-%d") # CoOpLive opening date
@@ -24,9 +25,8 @@ def convert_to_utc(local_date_str, local_time_str, timezone="Europe/London"):
 
 def write_to_influxdb(data_points):
     try:
-        with InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG) as client:
-            write_api = client.write_api(write_options=SYNCHRONOUS)
-            write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
+        write_api = get_client().write_api(write_options=SYNCHRONOUS)
+        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
     except Exception as e:
         print(f"Error writing to InfluxDB: {e}")
 
@@ -4,11 +4,12 @@ This script fetches data from the Manchester-I API and writes it to InfluxDB.
 
 import re
 import requests
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 from concurrent.futures import ThreadPoolExecutor
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.config import INFLUXDB_ORG, INFLUXDB_BUCKET
+from tools.influx import get_client
 
 # Configuration
 API_BASE_URL = "http://muo-backend.cs.man.ac.uk"
@@ -97,16 +98,15 @@ def fetch_json(url):
 
 def has_existing_data(timeseries_id, platform_id):
     try:
-        with InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG) as client:
-            query_api = client.query_api()
-            query = f'''
-                from(bucket: "{INFLUXDB_BUCKET}")
-                |> range(start: 0)
-                |> filter(fn: (r) => r["sensor_id"] == "{timeseries_id}" and r["platform_id"] == "{platform_id}")
-                |> limit(n: 1)
-            '''
-            result = query_api.query(query)
-            return len(result) > 0
+        query_api = get_client().query_api()
+        query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: 0)
+            |> filter(fn: (r) => r["sensor_id"] == "{timeseries_id}" and r["platform_id"] == "{platform_id}")
+            |> limit(n: 1)
+        '''
+        result = query_api.query(query)
+        return len(result) > 0
     except Exception as e:
         print(f"Error checking existing data for {timeseries_id} on platform {platform_id}: {e}")
         return False
@@ -116,9 +116,8 @@ def fetch_observations(timeseries_id):
 
 def write_to_influxdb(data_points):
     try:
-        with InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG) as client:
-            write_api = client.write_api(write_options=SYNCHRONOUS)
-            write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
+        write_api = get_client().write_api(write_options=SYNCHRONOUS)
+        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=data_points)
     except Exception as e:
         print(f"Error writing to InfluxDB: {e}")
 
@@ -2,6 +2,8 @@
 Simple ARIMA model for traffic speed forecasting
 """
 
+from datetime import datetime, timedelta
+
 import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.arima.model import ARIMA
@@ -9,23 +11,13 @@ from statsmodels.tsa.arima.model import ARIMA
 from model.data_loader import DataLoader
 
 dataloader = DataLoader()
-query_api = dataloader.query_api
-
-# Query traffic data
-traffic_source = 'drakewell-1163'
-traffic_query = f"""
-from(bucket:"manchester-i")
-  |> range(start:-365d)
-  |> filter(fn: (r) => r._measurement == "Traffic" and r.platform_id == "drakewell__1163" and r.sensor_type == "vehicle-speed" and r.sensor_id == "avgspeed_nw")
-  |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-"""
-traffic_data = query_api.query_data_frame(traffic_query)
 
-traffic_data['_time'] = pd.to_datetime(traffic_data['_time'])
-traffic_data.set_index('_time', inplace=True)
-speed_data = traffic_data[traffic_data['value'] > 0]
+# Query traffic data of the last 365 days
+stop_time = datetime.utcnow()
+start_time = stop_time - timedelta(days=365)
+traffic_data = dataloader.query_traffic_data(start_time, stop_time, "drakewell__1163", "avgspeed_nw", columns=[])
 
-ts = speed_data["value"]
+ts = pd.Series(traffic_data["value"].to_numpy(), index=pd.to_datetime(traffic_data["_time"], unit="ns"))
 
 # train-test split
 train_size = int(len(ts) * 0.8)
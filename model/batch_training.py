@@ -3,8 +3,18 @@ This script is used to batch train models for every sensor in the database that
 """
 from datetime import datetime
 
+import numpy as np
+
 from model.data_loader import DataLoader
-from model.train_model_nn import train_model
+from model.event_index import get_event_index
+from model.sensor_catalog import get_sensor_catalog
+from model.spatial_index import get_venue_index
+from model.train_model_nn import train_model, train_multi_sensor_model
+
+# Train one model for all sensors out of core (see chunked_features.py) instead of one model per sensor
+MULTI_SENSOR_MODEL = False
+# Only train the sensors within this many km of an event venue, None for every sensor
+EVENT_VENUE_RADIUS_KM = None
 
 loader = DataLoader()
 
@@ -14,21 +24,38 @@ minutes_per_day = 24 * 60 / 5  # 5-minute intervals per day
 total_expected_points = (end_date - start_date).days * minutes_per_day
 threshold = 0.8 * total_expected_points  # 80% threshold
 
-traffic_query = f'''
-from(bucket: "manchester-i")
-  |> range(start: {start_date.isoformat()}Z, stop: {end_date.isoformat()}Z)
-  |> filter(fn: (r) => r._measurement == "Traffic" and r.sensor_type == "vehicle-speed")
-  |> filter(fn: (r) => r["_value"] > 0)
-  |> group(columns: ["platform_id", "sensor_id"])
-  |> count()
-'''
-
-traffic_results = loader.query_api.query(traffic_query)
-loader.close()
-
-for table in traffic_results:
-    for record in table.records:
-        # Threshold makes sure the sensor has over 80% data points for our required period - removes bad sensors
-        if record["_value"] >= threshold and record["platform_id"] >= "drakewell__1429":
-            print("TRAINING MODEL FOR", record["platform_id"], record["sensor_id"])
-            train_model(start_date, end_date, record["platform_id"], record["sensor_id"])
+# Sample counts come from the sensor catalog instead of a count() over every sensor's history
+catalog = get_sensor_catalog(loader.backend)
+
+sensors = []
+for entry in catalog.sensors(sensor_type="vehicle-speed"):
+    sample_count = catalog.sample_count(entry["platform_id"], entry["sensor_id"], start_date, end_date)
+    # Threshold makes sure the sensor has over 80% data points for our required period - removes bad sensors
+    if sample_count >= threshold and entry["platform_id"] >= "drakewell__1429":
+        sensors.append((entry["platform_id"], entry["sensor_id"]))
+
+venue_index = None
+if EVENT_VENUE_RADIUS_KM is not None:
+    # Sensors near the venues of the period, from the catalog's spatial index instead of every sensor-venue distance
+    events = get_event_index(loader.backend).slice(start_date, end_date)
+    venues = np.unique(np.column_stack([events.lats, events.lons]), axis=0)
+    venue_index = get_venue_index(venues[np.isfinite(venues).all(axis=1)])
+    near = {key for lat, lon in venue_index.points for key, _ in catalog.sensors_near(lat, lon, EVENT_VENUE_RADIUS_KM)}
+    sensors = [key for key in sensors if key in near]
+
+if MULTI_SENSOR_MODEL:
+    # Traffic is loaded one time slice at a time while the features are engineered
+    loader.close()
+    print("TRAINING MODEL FOR", len(sensors), "SENSORS")
+    train_multi_sensor_model(start_date, end_date, sensors)
+else:
+    # Fetch the history of every sensor in one pass, each window is a single query for all sensors
+    traffic = loader.batch_query_traffic_multi(start_date, end_date, 7, sensors, columns=["location"])
+    loader.close()
+
+    for platform_id, sensor_id in sensors:
+        print("TRAINING MODEL FOR", platform_id, sensor_id)
+        if venue_index is not None:
+            nearby, _ = catalog.venues_near(platform_id, sensor_id, venue_index, EVENT_VENUE_RADIUS_KM)
+            print(f"{len(nearby)} event venues within {EVENT_VENUE_RADIUS_KM} km")
+        train_model(start_date, end_date, platform_id, sensor_id, traffic=traffic.pop((platform_id, sensor_id)))
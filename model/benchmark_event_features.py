@@ -0,0 +1,55 @@
+"""
+This script benchmarks FeatureEngineering.add_event_features against the original row-wise implementation.
+
+Both versions are run on the same traffic and event data, the outputs are checked to be equal and the run times are
+printed. Set INFLUXDB_BACKEND = "file" in tools/config.py to run it on a local snapshot (see tools/snapshot_influx.py).
+"""
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+from model.data_loader import DataLoader
+from model.event_index import get_event_index
+from model.feature_engineering import FeatureEngineering, add_time_features
+
+
+def assert_same_features(expected, actual):
+    if list(expected.columns) != list(actual.columns):
+        raise AssertionError(f"Columns differ: {list(expected.columns)} != {list(actual.columns)}")
+    for column in expected.columns:
+        left, right = expected[column].to_numpy(), actual[column].to_numpy()
+        if column == "has_event":
+            # The row-wise version mixes 0 and True in this column
+            left, right = left.astype(float), right.astype(float)
+        if not np.array_equal(left, right):
+            raise AssertionError(f"Column {column} differs")
+
+
+def benchmark(start_date, end_date, platform_id, sensor_id):
+    loader = DataLoader()
+    traffic = loader.batch_query_traffic(start_date, end_date, 7, platform_id, sensor_id, columns=["location"])
+    events = get_event_index(loader.backend).slice(start_date, end_date)
+    loader.close()
+
+    df = add_time_features(traffic)
+    fe = FeatureEngineering(events, None)
+    print(f"{len(df)} rows, {len(events)} events")
+
+    start = time.perf_counter()
+    expected = fe.add_event_features_rowwise(df.copy())
+    rowwise_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = fe.add_event_features(df.copy())
+    vectorized_seconds = time.perf_counter() - start
+
+    assert_same_features(expected, actual)
+    print(f"Row-wise:   {rowwise_seconds:.3f} s")
+    print(f"Vectorized: {vectorized_seconds:.3f} s")
+    print(f"Speedup:    {rowwise_seconds / vectorized_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    benchmark(datetime(2024, 1, 1), datetime(2024, 3, 1), "drakewell__1163", "avgspeed_nw")
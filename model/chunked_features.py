@@ -0,0 +1,227 @@
+"""
+This module contains the out-of-core feature engineering, for histories of many sensors that do not fit in memory.
+
+The time range is processed in slices of chunk_days. For every slice only the traffic of that slice is loaded, and the
+events within EVENT_MARGIN_NS of the slice are carried over from the neighbouring slices, so rows near a slice boundary
+get the same event features as in a single pass over the whole range. The features of each slice are yielded and can be
+appended to a memory-mapped .npy file (FeatureFileWriter) or cut into training batches (iter_batches), so peak memory
+depends on the slice length and not on the length of the history. The scaling statistics of the columns are
+accumulated while the slices are written (see feature_scalers), as a scaler cannot be fit on the whole file in memory.
+"""
+
+import ast
+import json
+import os
+import struct
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from model.data_loader import DataLoader, batch_windows, query_weather_data
+from model.distance_cache import get_distance_cache
+from model.event_index import get_event_index, to_epoch_ns
+from model.feature_pipeline import FeaturePipeline
+from model.feature_store import EVENT_MARGIN_NS
+
+CHUNK_DAYS = 28
+QUERY_BATCH_DAYS = 7
+NPY_HEADER_BYTES = 128  # Room for the .npy header of any row count, so the file can be appended to
+
+
+def iter_feature_chunks(loader, start_date, end_date, sensors, events, distance_cache=None, schema="FFNN",
+                        chunk_days=CHUNK_DAYS):
+    """
+    Engineer the features of the traffic of sensors over [start_date, end_date), one time slice at a time. Yields
+    (platform_id, sensor_id, features) for every sensor with traffic in a slice, in time order. events is the shared
+    EventIndex. Events and weather are only used, and the traffic tags only queried, if the schema depends on them.
+    """
+    schema_pipeline = FeaturePipeline(schema)
+    columns = schema_pipeline.columns
+    sources = schema_pipeline.required_sources()
+    needs_weather = "weather" in sources
+    tags = sorted(schema_pipeline.required_inputs() - {"_time", "value"})
+
+    for window_start, window_end in batch_windows(start_date, end_date, chunk_days):
+        traffic = loader.batch_query_traffic_multi(window_start, window_end, QUERY_BATCH_DAYS, sensors, columns=tags)
+        window_events = None
+        if "events" in sources:
+            window_events = events.slice(to_epoch_ns(window_start) - EVENT_MARGIN_NS,
+                                         to_epoch_ns(window_end) + EVENT_MARGIN_NS)
+
+        for platform_id, sensor_id in sensors:
+            sensor_traffic = traffic.pop((platform_id, sensor_id), None)
+            if sensor_traffic is None or sensor_traffic.empty:
+                continue
+            weather = None
+            if needs_weather:
+                # The weather query includes the day of window_end, so the nearest hour of every row is covered
+                lon, lat = ast.literal_eval(sensor_traffic["location"].iloc[0])
+                weather = query_weather_data(window_start, window_end, lat, lon)
+            pipeline = FeaturePipeline(columns, window_events, weather, distance_cache)
+            yield platform_id, sensor_id, pipeline.transform(sensor_traffic)
+
+
+def build_feature_file(start_date, end_date, sensors, path, schema="FFNN", chunk_days=CHUNK_DAYS):
+    # Engineer the features of all sensors into one feature file, returns the number of rows
+    loader = DataLoader()
+    pipeline = FeaturePipeline(schema)
+    events = get_event_index(loader.backend) if "events" in pipeline.required_sources() else None
+    columns = ["value"] + [column for column in pipeline.columns if column != "value"]
+    distance_cache = get_distance_cache()
+    chunks = iter_feature_chunks(loader, start_date, end_date, sensors, events, distance_cache, schema, chunk_days)
+    rows = write_feature_file(chunks, path, columns)
+    distance_cache.flush()
+    loader.close()
+    return rows
+
+
+def _npy_header(shape, dtype):
+    # Version 1.0 .npy header padded to NPY_HEADER_BYTES, so a larger shape can be written over it later
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                   "shape": tuple(shape)}).encode("latin1")
+    prefix = np.lib.format.magic(1, 0)
+    padding = NPY_HEADER_BYTES - len(prefix) - 2 - len(header) - 1
+    return prefix + struct.pack("<H", len(header) + padding + 1) + header + b" " * padding + b"\n"
+
+
+class _NpyAppender:
+    # A .npy file that rows are appended to, its header is rewritten with the final row count on close
+    def __init__(self, path, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.file.write(_npy_header((0,) + self.row_shape, self.dtype))
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self.file.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(_npy_header((self.rows,) + self.row_shape, self.dtype))
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class FeatureFileWriter:
+    """
+    Appends feature slices to <path>.npy (float32 matrix of the columns), <path>.time.npy (int64 epoch ns) and
+    <path>.json (columns, row count and the mean and variance of every column). <path>.json is written last, when the
+    writer is closed, and marks the files as complete. If writing fails the partial files are removed.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.matrix = _NpyAppender(f"{path}.npy", np.float32, (len(self.columns),))
+        self.times = _NpyAppender(f"{path}.time.npy", np.int64)
+        self.scaler = StandardScaler()
+
+    def append(self, features):
+        matrix = features[self.columns].to_numpy(dtype=np.float32)
+        self.matrix.append(matrix)
+        self.times.append(_time_ns(features["_time"]))
+        if len(matrix):
+            self.scaler.partial_fit(matrix)
+
+    def close(self):
+        self.matrix.close()
+        self.times.close()
+        stats = {}
+        if self.matrix.rows:
+            stats = {"mean": self.scaler.mean_.tolist(), "var": self.scaler.var_.tolist(),
+                     "count": np.broadcast_to(self.scaler.n_samples_seen_, len(self.columns)).tolist()}
+        with open(f"{self.path}.json", "w") as f:
+            json.dump({"columns": self.columns, "rows": self.matrix.rows, **stats}, f, indent=2)
+
+    def discard(self):
+        self.matrix.discard()
+        self.times.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _time_ns(times):
+    if np.issubdtype(times.dtype, np.integer):
+        return times.to_numpy(dtype=np.int64)
+    return times.to_numpy().astype("datetime64[ns]").view(np.int64)
+
+
+def write_feature_file(chunks, path, columns):
+    # Write the features of iter_feature_chunks to a feature file, returns the number of rows written
+    with FeatureFileWriter(path, columns) as writer:
+        for _, _, features in chunks:
+            writer.append(features)
+    return writer.matrix.rows
+
+
+def _standard_scaler(mean, var, count):
+    # A fitted StandardScaler from column statistics
+    scaler = StandardScaler()
+    scaler.mean_ = np.asarray(mean, dtype=np.float64)
+    scaler.var_ = np.asarray(var, dtype=np.float64)
+    scale = np.sqrt(scaler.var_)
+    scaler.scale_ = np.where(scale == 0, 1.0, scale)  # Constant columns are left unscaled, as StandardScaler does
+    scaler.n_samples_seen_ = np.asarray(count, dtype=np.int64)
+    scaler.n_features_in_ = len(scaler.mean_)
+    return scaler
+
+
+def feature_scalers(path, target="value"):
+    # Scalers of the feature columns (x) and of the target column (y), from the statistics of a feature file
+    with open(f"{path}.json", "r") as f:
+        info = json.load(f)
+    columns = info["columns"]
+    features = [i for i, column in enumerate(columns) if column != target]
+    target_index = columns.index(target)
+
+    def pick(indexes):
+        return _standard_scaler(*([info[key][i] for i in indexes] for key in ("mean", "var", "count")))
+
+    return pick(features), pick([target_index])
+
+
+def open_feature_file(path):
+    # Memory-mapped (times, matrix) and the column names of a feature file
+    with open(f"{path}.json", "r") as f:
+        columns = json.load(f)["columns"]
+    times = np.load(f"{path}.time.npy", mmap_mode="r")
+    matrix = np.load(f"{path}.npy", mmap_mode="r")
+    return times, matrix, columns
+
+
+def iter_batches(chunks, batch_size, feature_columns, target="value"):
+    """
+    Cut the features of iter_feature_chunks into (X, y) float32 batches of batch_size rows. Rows left over at the end
+    of a slice are carried into the next batch, only the last batch can be smaller.
+    """
+    pending_x, pending_y, pending = [], [], 0
+    for _, _, features in chunks:
+        X = features[feature_columns].to_numpy(dtype=np.float32)
+        y = features[target].to_numpy(dtype=np.float32).reshape(-1, 1)
+        row = 0
+        while row < len(X):
+            take = min(batch_size - pending, len(X) - row)
+            pending_x.append(X[row:row + take])
+            pending_y.append(y[row:row + take])
+            pending += take
+            row += take
+            if pending == batch_size:
+                yield np.concatenate(pending_x), np.concatenate(pending_y)
+                pending_x, pending_y, pending = [], [], 0
+    if pending:
+        yield np.concatenate(pending_x), np.concatenate(pending_y)
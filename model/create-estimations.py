@@ -7,30 +7,27 @@ These can then be used as a feature in the final model.
 
 import json
 import time
+from datetime import datetime
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
 from openai import OpenAI
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET, OPENROUTER_KEY
-
-def get_events(client):
-    query_api = client.query_api()
-    flux_query = f'''
-    from(bucket:"{INFLUXDB_BUCKET}")
-      |> range(start: 2020-01-01T00:00:00Z)
-      |> filter(fn: (r) => r._measurement == "Event" and r._value == 0)
-    '''
-    result = query_api.query(flux_query, org=INFLUXDB_ORG)
+from tools.config import OPENROUTER_KEY
+from tools.storage import get_backend
+
+def get_events(backend):
+    # Events without an attendance estimate yet
+    df = backend.events(datetime(2020, 1, 1))
+    if df.empty or "estimated_attendance" not in df.columns:
+        return []
     events = []
-    for table in result:
-        for record in table.records:
-            event = {
-                "event_type": record.values.get("event_type"),
-                "event_name": record.values.get("event_name"),
-                "location": record.values.get("location"),
-                "venue": record.values.get("venue"),
-                "timestamp": record.get_time()
-            }
-            events.append(event)
+    for row in df[df["estimated_attendance"] == 0].to_dict("records"):
+        event = {
+            "event_type": row.get("event_type"),
+            "event_name": row.get("event_name"),
+            "location": row.get("location"),
+            "venue": row.get("venue"),
+            "timestamp": row["_time"].to_pydatetime()
+        }
+        events.append(event)
     return events
 
 
@@ -62,32 +59,23 @@ def query_llm_for_estimates(llm_client, events_chunk):
         return {}
 
 
-def update_event_estimate(client, event, estimated_attendance):
-    write_api = client.write_api()
-
+def update_event_estimate(backend, event, estimated_attendance):
     # Overwrite point
-    point = (
-        Point("Event")
-        .tag("event_type", event["event_type"])
-        .tag("location", event["location"])
-        .tag("venue", event["venue"])
-        .tag("event_name", event["event_name"])
-        .field("estimated_attendance", estimated_attendance)
-        .time(event["timestamp"], WritePrecision.NS)
-    )
-    write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=point)
+    tags = {key: event[key] for key in ("event_type", "location", "venue", "event_name")}
+    backend.write([{"measurement": "Event", "tags": tags, "fields": {"estimated_attendance": estimated_attendance},
+                    "time": event["timestamp"]}])
     print(
         f"Updated event (ID: {event['event_id']}) at timestamp {event['timestamp']} with estimated attendance: {estimated_attendance}")
 
 
 def main():
-    data_client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
+    backend = get_backend()
     llm_client = OpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=OPENROUTER_KEY,
     )
 
-    events = get_events(data_client)
+    events = get_events(backend)
     print(f"Retrieved {len(events)} events from InfluxDB")
 
     for events_chunk in chunk_list(events, 20):
@@ -99,7 +87,7 @@ def main():
         for event in events_chunk:
             event_id = event["event_id"]
             if event_id in estimates:
-                update_event_estimate(data_client, event, estimates[event_id])
+                update_event_estimate(backend, event, estimates[event_id])
             else:
                 print(f"No estimate returned for event ID {event_id}")
         # Prevent rate limiting
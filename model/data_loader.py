@@ -1,82 +1,185 @@
 """
-This module contains the DataLoader class, which is responsible for querying data from InfluxDB and the Open-Meteo API.
+This module contains the DataLoader class, which is responsible for querying data from InfluxDB (or another storage
+backend, see tools/storage.py) and the Open-Meteo API.
 
 The module is used by many scripts in the project to fetch traffic, event, and weather data.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
-import requests
-from influxdb_client import InfluxDBClient
 import pandas as pd
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET, WEATHER_URL
+from model.sensor_catalog import get_sensor_catalog
+from model.sensor_series import SensorSeries
+from model.traffic_cache import TrafficCache
+from model.weather_cache import WeatherCache
+from tools.config import INFLUXDB_QUERY_WORKERS
+from tools.storage import KEY_COLUMNS, get_backend
+
 
 def query_weather_data(start_date, stop_date, lat, lon):
-    endpoint = WEATHER_URL.format(lat=lat, lon=lon, start_date=start_date.strftime("%Y-%m-%d"), end_date=stop_date.strftime("%Y-%m-%d"))
-    response = requests.get(endpoint)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch weather data: {response.status_code}")
-        return None
+    # Weather history does not change, so it is served from the on-disk cache where possible
+    return WeatherCache().query(start_date, stop_date, lat, lon)
+
+
+def batch_windows(start_date, end_date, batch_days):
+    windows = []
+    current_date = start_date
+
+    while current_date < end_date:
+        next_batch = current_date + timedelta(days=batch_days)
+        if next_batch > end_date:
+            next_batch = end_date
+
+        windows.append((current_date, next_batch))
+        current_date = next_batch
+
+    return windows
+
+
+def concat_traffic_frames(frames):
+    # Tags stay categorical, pd.concat turns categoricals with different categories into objects
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    for column in df.columns[2:]:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = pd.Categorical(df[column])
+    return df
 
 
 class DataLoader:
-    def __init__(self):
-        self.client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-        self.query_api = self.client.query_api()
+    def __init__(self, use_cache=True, backend=None):
+        # The storage backend defaults to the one selected in tools/config.py (see tools/storage.py)
+        self.backend = backend if backend is not None else get_backend()
+        self.cache = TrafficCache() if use_cache else None
 
     def query_event_data(self, start_time, stop_time):
-        query = f'''
-        from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: {start_time.isoformat()}Z, stop: {stop_time.isoformat()}Z)
-        |> filter(fn: (r) => r["_measurement"] == "Event")
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-        '''
-        result = self.query_api.query_data_frame(query)
-        return result
-
-    def query_traffic_data(self, start_time, stop_time, platform_id, sensor_id):
-        query = f'''
-        from(bucket: "{INFLUXDB_BUCKET}")
-        |> range(start: {start_time.isoformat()}Z, stop: {stop_time.isoformat()}Z)
-        |> filter(fn: (r) => r["_measurement"] == "Traffic" and r["sensor_type"] == "vehicle-speed" and r["sensor_id"] == "{sensor_id}" and r["platform_id"] == "{platform_id}")
-        |> filter(fn: (r) => r["_value"] > 0)
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-        '''
-        result = self.query_api.query_data_frame(query)
-        return result
-
-    def lookup_sensor_location(self, platform_id, sensor_id):
-        query = f'''
-                from(bucket: "{INFLUXDB_BUCKET}")
-                |> range(start:-365d)
-                |> filter(fn: (r) => r["_measurement"] == "Traffic" and r["sensor_type"] == "vehicle-speed" and r["sensor_id"] == "{sensor_id}" and r["platform_id"] == "{platform_id}")
-                |> filter(fn: (r) => r["_value"] > 0)
-                |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-                '''
-        result = self.query_api.query_data_frame(query)
-        return result["location"].iloc[0]
-
-    def batch_query_traffic(self, start_date, end_date, batch_days, platform_id, sensor_id):
-        all_data = []
-        current_date = start_date
+        return self.backend.events(start_time, stop_time)
 
-        while current_date < end_date:
-            next_batch = current_date + timedelta(days=batch_days)
-            if next_batch > end_date:
-                next_batch = end_date
+    def query_traffic_data(self, start_time, stop_time, platform_id, sensor_id, columns=None):
+        # Compact traffic frame (see tools/storage.py) with the tags in columns, all tags if None
+        result = self.query_traffic_data_multi(start_time, stop_time, [(platform_id, sensor_id)], columns)
+        if result.empty or columns is None:
+            return result
+        return result.drop(columns=[column for column in KEY_COLUMNS if column not in (columns or [])])
 
-            print(f"Querying from {current_date} to {next_batch}...")
+    def query_traffic_data_multi(self, start_time, stop_time, sensors, columns=None):
+        # One query for many (platform_id, sensor_id) pairs, returned as a long frame with the sensor keys
+        return concat_traffic_frames(list(self.backend.traffic(start_time, stop_time, sensors, columns)))
 
-            data = self.query_traffic_data(current_date, next_batch, platform_id, sensor_id)
-            if data is not None:
-                all_data.append(data)
+    def lookup_sensor_location(self, platform_id, sensor_id):
+        catalog = get_sensor_catalog(self.backend)
+        location = catalog.location(platform_id, sensor_id)
+        if location is None:
+            # The sensor may have been added since the last refresh
+            catalog.refresh(self.backend)
+            location = catalog.location(platform_id, sensor_id)
+        if location is None:
+            raise KeyError(f"Sensor {platform_id} {sensor_id} not found in the sensor catalog")
+        return location
+
+    def _missing_windows(self, start_date, end_date, batch_days, platform_id, sensor_id, columns):
+        # Only query the storage backend for the time ranges that are not cached locally
+        if self.cache is not None:
+            ranges = self.cache.missing_ranges(platform_id, sensor_id, start_date, end_date, columns)
+        else:
+            ranges = [(start_date, end_date)]
+        return [window for range_start, range_end in ranges for window in batch_windows(range_start, range_end, batch_days)]
+
+    def batch_query_traffic(self, start_date, end_date, batch_days, platform_id, sensor_id, max_workers=None,
+                            columns=None):
+        windows = self._missing_windows(start_date, end_date, batch_days, platform_id, sensor_id, columns)
+
+        def query_window(window):
+            print(f"Querying from {window[0]} to {window[1]}...")
+            return self.query_traffic_data(window[0], window[1], platform_id, sensor_id, columns)
+
+        # Windows are fetched by a bounded pool of workers, results are returned in time order
+        all_data = []
+        with ThreadPoolExecutor(max_workers=max_workers or INFLUXDB_QUERY_WORKERS) as executor:
+            for (window_start, window_end), data in zip(windows, executor.map(query_window, windows)):
+                if self.cache is not None:
+                    self.cache.store(platform_id, sensor_id, window_start, window_end, data, columns)
+                elif data is not None:
+                    all_data.append(data)
 
-            current_date = next_batch
+        if self.cache is not None:
+            return self.cache.load(platform_id, sensor_id, start_date, end_date, columns)
 
         return pd.concat(all_data, ignore_index=True) if all_data else None
 
+    def stream_traffic_data(self, start_date, end_date, batch_days, platform_id, sensor_id, columns=None):
+        # Yields the traffic of one sensor as the chunks of the backend (see tools/storage.py), window by window in
+        # time order, without collecting them into one frame
+        for window_start, window_end in batch_windows(start_date, end_date, batch_days):
+            print(f"Streaming from {window_start} to {window_end}...")
+            for chunk in self.backend.traffic(window_start, window_end, [(platform_id, sensor_id)], columns):
+                yield chunk.drop(columns=[column for column in KEY_COLUMNS if column not in (columns or [])])
+
+    def query_sensor_series(self, start_date, end_date, platform_id, sensor_id, batch_days=7):
+        # Traffic for one sensor as a SensorSeries on the 5 minute grid covering [start_date, end_date). The points
+        # are written into the grid one chunk at a time, from the backend's chunks when there is no cache or from the
+        # cache's monthly partitions, so peak memory is the grid plus one chunk whatever the length of the history.
+        columns = ["location"]
+        if self.cache is None:
+            chunks = self.stream_traffic_data(start_date, end_date, batch_days, platform_id, sensor_id, columns)
+        else:
+            for window_start, window_end in self._missing_windows(start_date, end_date, batch_days, platform_id,
+                                                                  sensor_id, columns):
+                data = concat_traffic_frames(list(self.stream_traffic_data(window_start, window_end, batch_days,
+                                                                           platform_id, sensor_id, columns)))
+                self.cache.store(platform_id, sensor_id, window_start, window_end, data, columns)
+            chunks = self.cache.iter_load(platform_id, sensor_id, start_date, end_date, columns)
+        return SensorSeries.from_chunks(chunks, start_date, end_date, platform_id=platform_id, sensor_id=sensor_id)
+
+    def batch_query_traffic_multi(self, start_date, end_date, batch_days, sensors, max_workers=None, columns=None):
+        # Work out which time ranges are missing for each sensor
+        missing = {}
+        for platform_id, sensor_id in sensors:
+            if self.cache is not None:
+                missing[(platform_id, sensor_id)] = self.cache.missing_ranges(platform_id, sensor_id, start_date, end_date,
+                                                                              columns)
+            else:
+                missing[(platform_id, sensor_id)] = [(start_date, end_date)]
+
+        # Each window queries only the sensors that still need data in it
+        jobs = []
+        for window_start, window_end in batch_windows(start_date, end_date, batch_days):
+            window_sensors = [key for key, ranges in missing.items()
+                              if any(start < window_end and stop > window_start for start, stop in ranges)]
+            if window_sensors:
+                jobs.append((window_start, window_end, window_sensors))
+
+        def query_window(job):
+            print(f"Querying {len(job[2])} sensors from {job[0]} to {job[1]}...")
+            return self.query_traffic_data_multi(job[0], job[1], job[2], columns)
+
+        all_data = {key: [] for key in missing}
+        with ThreadPoolExecutor(max_workers=max_workers or INFLUXDB_QUERY_WORKERS) as executor:
+            for (window_start, window_end, window_sensors), data in zip(jobs, executor.map(query_window, jobs)):
+                groups = {}
+                if data is not None and not data.empty:
+                    groups = dict(list(data.groupby(["platform_id", "sensor_id"], observed=True)))
+
+                for key in window_sensors:
+                    sensor_data = groups.get(key)
+                    if sensor_data is not None and columns is not None:
+                        # The key columns were only added to split the frame, the partitions of a schema keep the
+                        # layout of query_traffic_data
+                        sensor_data = sensor_data.drop(columns=[column for column in KEY_COLUMNS
+                                                                if column not in columns]).reset_index(drop=True)
+                    if self.cache is not None:
+                        self.cache.store(key[0], key[1], window_start, window_end, sensor_data, columns)
+                    elif sensor_data is not None:
+                        all_data[key].append(sensor_data)
+
+        if self.cache is not None:
+            return {key: self.cache.load(key[0], key[1], start_date, end_date, columns) for key in missing}
+
+        return {key: pd.concat(frames, ignore_index=True) if frames else None for key, frames in all_data.items()}
+
     def close(self):
-        self.client.close()
+        # The backend is shared by the whole process, its client is closed when it exits (see tools/influx.py)
+        self.backend = None
@@ -0,0 +1,192 @@
+"""
+This module contains the ArrayDataset and WindowedSeries classes, the input pipelines used by ModelTrainer.
+
+Features and targets stay where they are (in memory or memory-mapped, e.g. a feature file written by
+chunked_features.py) and are read one batch at a time, in parallel with training and prefetched ahead of it. As with
+Keras' validation_split, the last validation_fraction of the rows are used for validation, but the split is a range of
+row positions rather than a copy of the arrays. Scalers given to the dataset are applied to each batch as it is read.
+
+WindowedSeries serves the windows of sequence models. The series of one or more sensors are kept as a single
+contiguous (rows, features) array and every batch of windows is cut from it when Keras asks for it, so memory is
+O(rows) rather than O(rows x window size).
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.utils import PyDataset
+
+from model.chunked_features import feature_scalers, open_feature_file
+from model.windowing import window_starts
+
+SHUFFLE_BUFFER = 1 << 20  # Rows, the training rows are shuffled within a window of this size
+
+
+class ArrayDataset:
+    def __init__(self, X, y, validation_fraction=0.2, batch_size=256, shuffle_buffer=SHUFFLE_BUFFER, seed=None,
+                 rows=None, x_scaler=None, y_scaler=None):
+        # rows are the positions of the rows to use, e.g. the windows without gaps (see windowing.py), default all.
+        # x_scaler and y_scaler are fitted scalers applied to every batch.
+        if len(X) != len(y):
+            raise ValueError(f"X has {len(X)} rows but y has {len(y)}")
+        self.X = X
+        self.y = y.reshape(-1, 1) if y.ndim == 1 else y
+        self.rows = np.asarray(rows, dtype=np.int64) if rows is not None else None
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.x_scaler = x_scaler
+        self.y_scaler = y_scaler
+        self.split_index = int(self.row_count * (1 - validation_fraction))
+        self.feature_file = None  # (path, target) when X and y are read from a feature file
+
+    @classmethod
+    def from_feature_file(cls, path, target="value", **kwargs):
+        # Memory-mapped features of a feature file, the target column is y and the other columns are X. Batches are
+        # scaled with the scalers of the file (see feature_scalers).
+        _, matrix, columns = open_feature_file(path)
+        x_scaler, y_scaler = feature_scalers(path, target)
+        target_index = columns.index(target)
+        feature_indexes = [i for i in range(len(columns)) if i != target_index]
+        if feature_indexes == list(range(feature_indexes[0], feature_indexes[-1] + 1)):
+            X = matrix[:, feature_indexes[0]:feature_indexes[-1] + 1]  # A view, no copy
+        else:
+            X = matrix[:, feature_indexes]
+        dataset = cls(X, matrix[:, target_index:target_index + 1], x_scaler=x_scaler, y_scaler=y_scaler, **kwargs)
+        dataset.feature_file = (path, target)
+        return dataset
+
+    @property
+    def row_count(self):
+        return len(self.X) if self.rows is None else len(self.rows)
+
+    @property
+    def shape(self):
+        return (self.row_count,) + tuple(self.X.shape[1:])
+
+    def _scaled(self, X, y):
+        if self.x_scaler is not None:
+            X = self.x_scaler.transform(X)
+        if self.y_scaler is not None:
+            y = self.y_scaler.transform(y)
+        return np.asarray(X, dtype=np.float32), np.asarray(y, dtype=np.float32)
+
+    def _gather(self, positions):
+        # Rows are read in position order, which keeps reads from memory-mapped files sequential
+        positions = np.sort(positions)
+        return self._scaled(self.X[positions], self.y[positions])
+
+    def _slice(self, start):
+        stop = min(start + self.batch_size, len(self.X))
+        return self._scaled(self.X[start:stop], self.y[start:stop])
+
+    def _batches(self, rows, read, deterministic=False):
+        batches = rows.map(lambda positions: tf.numpy_function(read, [positions], [tf.float32, tf.float32]),
+                           num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+        x_shape, y_shape = (None,) + tuple(self.X.shape[1:]), (None,) + tuple(self.y.shape[1:])
+        batches = batches.map(lambda X, y: (tf.ensure_shape(X, x_shape), tf.ensure_shape(y, y_shape)))
+        return batches.prefetch(tf.data.AUTOTUNE)
+
+    def train(self):
+        # Shuffled batches of the training rows, reshuffled every epoch
+        if self.rows is None:
+            rows = tf.data.Dataset.range(self.split_index)
+        else:
+            rows = tf.data.Dataset.from_tensor_slices(self.rows[:self.split_index])
+        rows = rows.shuffle(min(self.shuffle_buffer, max(1, self.split_index)), seed=self.seed,
+                            reshuffle_each_iteration=True)
+        return self._batches(rows.batch(self.batch_size), self._gather)
+
+    def validation(self):
+        # Batches of the validation rows in order, each batch is a contiguous slice when all rows are used
+        if self.rows is not None:
+            rows = tf.data.Dataset.from_tensor_slices(self.rows[self.split_index:])
+            return self._batches(rows.batch(self.batch_size), self._gather, deterministic=True)
+        starts = tf.data.Dataset.range(self.split_index, len(self.X), self.batch_size)
+        return self._batches(starts, self._slice, deterministic=True)
+
+    def validation_targets(self):
+        # Unscaled targets of the validation rows, in the order of validation()
+        if self.rows is not None:
+            return np.asarray(self.y[self.rows[self.split_index:]])
+        return np.asarray(self.y[self.split_index:])
+
+
+class WindowBatches(PyDataset):
+    # Batches of the windows starting at the given rows of data, cut when a batch is requested
+    def __init__(self, data, starts, window_size, target_index, horizon=1, batch_size=64, shuffle=False, seed=None,
+                 **kwargs):
+        super().__init__(**kwargs)  # workers, use_multiprocessing, max_queue_size
+        self.data = data
+        self.starts = starts
+        self.offsets = np.arange(window_size)
+        self.target_offset = window_size + horizon - 1
+        self.target_index = target_index
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = self.rng.permutation(len(starts)) if shuffle else np.arange(len(starts))
+
+    def __len__(self):
+        return -(-len(self.starts) // self.batch_size)
+
+    def __getitem__(self, index):
+        starts = np.sort(self.starts[self.order[index * self.batch_size:(index + 1) * self.batch_size]])
+        X = self.data[starts[:, np.newaxis] + self.offsets]
+        y = self.data[starts + self.target_offset, self.target_index].reshape(-1, 1)
+        return X, y
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+
+class WindowedSeries:
+    """
+    Windows of window_size rows over the series of one or more sensors, each series a (rows, features) array with an
+    optional boolean validity per row. Windows do not cross from one series into the next and windows with invalid
+    rows are left out. The last validation_fraction of the windows of every series are used for validation.
+    """
+
+    def __init__(self, series, window_size, target_index, valid=None, horizon=1, stride=1, validation_fraction=0.2,
+                 batch_size=64, seed=None, workers=1, use_multiprocessing=False):
+        if not isinstance(series, (list, tuple)):
+            series, valid = [series], [valid]
+        if valid is None:
+            valid = [None] * len(series)
+
+        # One contiguous float32 array, a single series that already is one is used as it is
+        if len(series) == 1:
+            self.data = np.ascontiguousarray(series[0], dtype=np.float32)
+        else:
+            self.data = np.concatenate(series).astype(np.float32, copy=False)
+        self.window_size = window_size
+        self.target_index = target_index
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.seed = seed
+        self.pool = {"workers": workers, "use_multiprocessing": use_multiprocessing}
+
+        train, validation, offset = [], [], 0
+        for rows, rows_valid in zip(series, valid):
+            starts = offset + window_starts(len(rows), window_size, horizon, stride, rows_valid)
+            split_index = int(len(starts) * (1 - validation_fraction))
+            train.append(starts[:split_index])
+            validation.append(starts[split_index:])
+            offset += len(rows)
+        self.train_starts = np.concatenate(train)
+        self.validation_starts = np.concatenate(validation)
+
+    @property
+    def shape(self):
+        return (len(self.train_starts) + len(self.validation_starts), self.window_size, self.data.shape[1])
+
+    def _batches(self, starts, shuffle):
+        return WindowBatches(self.data, starts, self.window_size, self.target_index, self.horizon, self.batch_size,
+                             shuffle, self.seed, **self.pool)
+
+    def train(self):
+        # Training windows, shuffled again every epoch
+        return self._batches(self.train_starts, shuffle=True)
+
+    def validation(self):
+        return self._batches(self.validation_starts, shuffle=False)
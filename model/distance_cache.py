@@ -0,0 +1,79 @@
+"""
+This module contains the DistanceCache class, a persistent cache of geodesic distances between sensor and event locations.
+
+Sensors and venues do not move, so the distance between a sensor location and a venue location is computed once and
+reused across rows, sensors and runs. Distances are kept in km in a JSON file keyed by the exact coordinates, so cached
+values are identical to freshly computed ones. New distances are written out every SAVE_EVERY pairs and when the
+process exits, rather than on every lookup.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+
+import numpy as np
+from geopy.distance import geodesic
+
+from tools.config import CACHE_DIR
+
+SAVE_EVERY = 1000  # New pairs computed before the file is written again
+
+_cache = None
+
+
+def _key(point):
+    # (lat, lon) as exact float strings
+    return f"{float(point[0])!r},{float(point[1])!r}"
+
+
+class DistanceCache:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "distances.json")
+        self.entries = {}
+        self.unsaved = 0
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # A temporary file of its own per save, so processes saving at the same time never write to the same file
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(self.entries, f)
+        os.replace(f.name, self.path)
+        self.unsaved = 0
+
+    def flush(self):
+        # Write out the distances computed since the last save
+        if self.unsaved:
+            self.save()
+
+    def distance(self, origin, destination):
+        return float(self.distances(origin, [destination])[0])
+
+    def distances(self, origin, destinations):
+        # Distances (km) from one (lat, lon) point to each (lat, lon) destination, missing pairs are computed
+        row = self.entries.setdefault(_key(origin), {})
+        result = np.empty(len(destinations))
+        for i, destination in enumerate(destinations):
+            key = _key(destination)
+            if key not in row:
+                row[key] = geodesic(tuple(origin), tuple(destination)).km
+                self.unsaved += 1
+            result[i] = row[key]
+
+        if self.unsaved >= SAVE_EVERY:
+            self.save()
+        return result
+
+
+def get_distance_cache():
+    # One cache per process, shared by everything computing event features
+    global _cache
+    if _cache is None:
+        _cache = DistanceCache()
+        atexit.register(_cache.flush)
+    return _cache
@@ -0,0 +1,117 @@
+"""
+This module contains the EventIndex class, an in-memory index of the Event measurement.
+
+Events are held as arrays sorted by time (int64 epoch nanoseconds) with their locations, types, venues and estimated
+attendance, so time ranges can be sliced with a binary search. A single index is shared by everything running in the
+process and is reloaded when the Event measurement changes.
+"""
+
+import ast
+import time
+
+import numpy as np
+import pandas as pd
+
+EVENT_INDEX_CHECK_SECONDS = 60  # Minimum time between checks for changes to the Event measurement
+
+_index = None
+
+
+def to_epoch_ns(value):
+    # Naive datetimes are treated as UTC, as in the DataLoader queries
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp.value
+
+
+class EventIndex:
+    def __init__(self, times, locations, lats, lons, event_types, venues, attendance):
+        self.times = times
+        self.locations = locations
+        self.lats = lats
+        self.lons = lons
+        self.event_types = event_types
+        self.venues = venues
+        self.attendance = attendance
+
+    @classmethod
+    def from_frame(cls, df):
+        if isinstance(df, list):
+            df = pd.concat(df, ignore_index=True) if df else pd.DataFrame()
+        if df is None or df.empty:
+            empty = np.array([], dtype=object)
+            return cls(np.array([], dtype=np.int64), empty, np.array([]), np.array([]), empty, empty, np.array([]))
+
+        times = pd.to_datetime(df["_time"], utc=True).dt.tz_convert(None).astype("datetime64[ns]")
+        times = times.to_numpy().view(np.int64)
+        order = np.argsort(times, kind="stable")
+
+        # Event locations are stored as "[lat, lon]"
+        locations = df["location"].to_numpy(dtype=object)[order]
+        coords = np.array([ast.literal_eval(location) for location in locations], dtype=np.float64).reshape(-1, 2)
+
+        def column(name, default):
+            if name in df.columns:
+                return df[name].to_numpy()[order]
+            return np.full(len(df), default)
+
+        return cls(
+            times[order],
+            locations,
+            coords[:, 0],
+            coords[:, 1],
+            column("event_type", None),
+            column("venue", None),
+            column("estimated_attendance", 0).astype(np.float64),
+        )
+
+    @property
+    def empty(self):
+        return len(self.times) == 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def slice(self, start_time, stop_time):
+        # Events in [start_time, stop_time), returned as views on the same arrays
+        lo = np.searchsorted(self.times, to_epoch_ns(start_time), side="left")
+        hi = np.searchsorted(self.times, to_epoch_ns(stop_time), side="left")
+        return EventIndex(self.times[lo:hi], self.locations[lo:hi], self.lats[lo:hi], self.lons[lo:hi],
+                          self.event_types[lo:hi], self.venues[lo:hi], self.attendance[lo:hi])
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "_time": pd.to_datetime(self.times, unit="ns", utc=True),
+            "venue": self.venues,
+            "event_type": self.event_types,
+            "location": self.locations,
+            "estimated_attendance": self.attendance,
+        })
+
+
+class _SharedEventIndex:
+    def __init__(self):
+        self.index = None
+        self.fingerprint = None
+        self.checked = 0.0
+
+    def get(self, backend):
+        if self.index is not None and time.monotonic() - self.checked < EVENT_INDEX_CHECK_SECONDS:
+            return self.index
+
+        fingerprint = backend.event_summary()
+        if self.index is None or fingerprint != self.fingerprint:
+            self.index = EventIndex.from_frame(backend.events())
+            self.fingerprint = fingerprint
+            print(f"Loaded {len(self.index)} events into the event index.")
+        self.checked = time.monotonic()
+        return self.index
+
+
+def get_event_index(backend):
+    # One index per process, reloaded when the Event measurement has changed
+    global _index
+    if _index is None:
+        _index = _SharedEventIndex()
+    return _index.get(backend)
@@ -0,0 +1,69 @@
+"""
+This module contains the sweep-line search used for the event features: for every row, the event nearest in time.
+
+Rows and events are both sorted by time (int64 epoch nanoseconds) and walked together, so the nearest event of every row
+is found in O(n + m). The same pass serves any number of time windows, as only the distance to the nearest event
+depends on the window.
+"""
+
+import numpy as np
+
+NO_EVENT = -1
+
+
+def _events_before(row_times, event_times):
+    # Number of events strictly before each row, for sorted rows and events. The stable sort of two sorted runs is a
+    # single linear merge, rows come first among equal times.
+    order = np.argsort(np.concatenate([row_times, event_times]), kind="stable")
+    is_row = order < len(row_times)
+    return np.cumsum(~is_row)[is_row]
+
+
+def _run_starts(event_times):
+    # Index of the first event with the same time, for every event
+    positions = np.arange(len(event_times))
+    starts = np.ones(len(event_times), dtype=bool)
+    starts[1:] = event_times[1:] != event_times[:-1]
+    return np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def nearest_events(row_times, event_times):
+    """
+    Nearest event in time for every row, for sorted event times. Returns the event index (NO_EVENT if there are no
+    events) and the absolute time difference in ns. Of events at the same time the first one is used, and the earlier
+    event wins a tie between an event before and one after the row.
+    """
+    row_times = np.asarray(row_times, dtype=np.int64)
+    event_times = np.asarray(event_times, dtype=np.int64)
+    chosen = np.full(len(row_times), NO_EVENT, dtype=np.int64)
+    gaps = np.full(len(row_times), np.iinfo(np.int64).max, dtype=np.int64)
+    if len(event_times) == 0 or len(row_times) == 0:
+        return chosen, gaps
+
+    # Rows are swept in time order and the results put back in the original order
+    row_order = None
+    if np.any(row_times[1:] < row_times[:-1]):
+        row_order = np.argsort(row_times, kind="stable")
+        row_times = row_times[row_order]
+
+    after = _events_before(row_times, event_times)
+    has_before = after > 0
+    has_after = after < len(event_times)
+    before = _run_starts(event_times)[np.maximum(after - 1, 0)]
+    after = np.minimum(after, len(event_times) - 1)
+
+    gap_before = np.where(has_before, row_times - event_times[before], np.iinfo(np.int64).max)
+    gap_after = np.where(has_after, event_times[after] - row_times, np.iinfo(np.int64).max)
+    use_before = gap_before <= gap_after
+
+    if row_order is None:
+        row_order = slice(None)
+    chosen[row_order] = np.where(use_before, before, after)
+    gaps[row_order] = np.minimum(gap_before, gap_after)
+    return chosen, gaps
+
+
+def nearest_events_within(row_times, event_times, window_hours):
+    # Nearest event within each of several windows (hours), from a single sweep. Maps hours to event indices.
+    chosen, gaps = nearest_events(row_times, event_times)
+    return {hours: np.where(gaps <= int(hours * 3600 * 10**9), chosen, NO_EVENT) for hours in window_hours}
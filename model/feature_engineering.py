@@ -2,6 +2,7 @@
 This module contains the FeatureEngineering class which is responsible for adding new features to the dataset.
 
 The module is used by the train_model_nn.py script to add time, weather, and event features to the traffic data.
+Event data is taken from the shared EventIndex (see event_index.py).
 """
 
 import ast
@@ -9,7 +10,19 @@ import pandas as pd
 import numpy as np
 from geopy.distance import geodesic
 from joblib import Parallel, delayed
-import multiprocessing
+
+from model.distance_cache import get_distance_cache
+from model.event_index import EventIndex
+from model.event_sweep import NO_EVENT, nearest_events_within
+from model.parallel import available_cpus
+from model.spatial_index import get_venue_index
+
+# Event feature engineering parameters
+TIME_WINDOW_HOURS = 12  # look for events within 12 hours before/after
+DISTANCE_WINDOW_KM = 3  # look for events within 3 km
+DEFAULT_DISTANCE = 100.0
+DEFAULT_TIME_DIFF = 100.0
+PARALLEL_MIN_ROWS = 5000  # Rows per worker below which the row-wise features are computed in this process
 
 def remove_unused_columns(df):
     columns_to_drop = ["_start", "_stop", "result", "table", "platform_description",
@@ -18,34 +31,73 @@ def remove_unused_columns(df):
     df.drop(columns=columns_to_drop, inplace=True, errors='ignore')
     return df
 
-def add_time_features(df):
-    # Convert the _time column to datetime
-    df["_time"] = pd.to_datetime(df["_time"])
+# Cyclic time encodings, looked up by minute of day, weekday and month instead of computed per row
+_MINUTE_OF_DAY = np.arange(24 * 60)
+HOUR_SIN = np.sin(2 * np.pi * (_MINUTE_OF_DAY // 60) / 24).astype(np.float32)
+HOUR_COS = np.cos(2 * np.pi * (_MINUTE_OF_DAY // 60) / 24).astype(np.float32)
+MINUTE_SIN = np.sin(2 * np.pi * (_MINUTE_OF_DAY % 60) / 60).astype(np.float32)
+MINUTE_COS = np.cos(2 * np.pi * (_MINUTE_OF_DAY % 60) / 60).astype(np.float32)
+WEEKDAY_SIN = np.sin(2 * np.pi * np.arange(7) / 7).astype(np.float32)
+WEEKDAY_COS = np.cos(2 * np.pi * np.arange(7) / 7).astype(np.float32)
+MONTH_SIN = np.sin(2 * np.pi * np.arange(12) / 12).astype(np.float32)
+MONTH_COS = np.cos(2 * np.pi * np.arange(12) / 12).astype(np.float32)
 
-    # Extract non-cyclic time features
-    df['year'] = df['_time'].dt.year
-    df['day'] = df['_time'].dt.day
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
 
-    # Cyclic encoding of time features
-    df['hour_sin'] = np.sin(2 * np.pi * df['_time'].dt.hour / 24)
-    df['hour_cos'] = np.cos(2 * np.pi * df['_time'].dt.hour / 24)
 
-    df['minute_sin'] = np.sin(2 * np.pi * df['_time'].dt.minute / 60)
-    df['minute_cos'] = np.cos(2 * np.pi * df['_time'].dt.minute / 60)
+def wall_clock_ns(times):
+    # Wall-clock time as int64 nanoseconds, which is what the .dt accessors use for tz-aware columns
+    if pd.api.types.is_integer_dtype(times):
+        return times.to_numpy(dtype=np.int64)
+    times = pd.to_datetime(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+    return times.astype("datetime64[ns]").to_numpy().view(np.int64)
 
-    df['weekday_sin'] = np.sin(2 * np.pi * df['_time'].dt.weekday / 7)
-    df['weekday_cos'] = np.cos(2 * np.pi * df['_time'].dt.weekday / 7)
 
-    df['month_sin'] = np.sin(2 * np.pi * (df['_time'].dt.month - 1) / 12)
-    df['month_cos'] = np.cos(2 * np.pi * (df['_time'].dt.month - 1) / 12)
+def add_time_features(df):
+    # Convert the _time column to datetime, int64 epoch nanoseconds are used as they are
+    times = wall_clock_ns(df["_time"])
+    if pd.api.types.is_integer_dtype(df["_time"]):
+        df["_time"] = times.view("datetime64[ns]")
+    else:
+        df["_time"] = pd.to_datetime(df["_time"])
+
+    minute_of_day = times // NS_PER_MINUTE % (24 * 60)
+    days = times // NS_PER_DAY
+    weekday = (days + 3) % 7  # 1970-01-01 was a Thursday
+    months = times.view("datetime64[ns]").astype("datetime64[M]").astype(np.int64)  # months since 1970-01
+
+    # Extract non-cyclic time features
+    df['year'] = (months // 12 + 1970).astype(np.int32)
+    df['day'] = (days - months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + 1).astype(np.int32)
+
+    # Cyclic encoding of time features, gathered from the tables into one preallocated float32 block
+    features = np.empty((8, len(times)), dtype=np.float32)
+    lookups = [
+        ("hour_sin", HOUR_SIN, minute_of_day), ("hour_cos", HOUR_COS, minute_of_day),
+        ("minute_sin", MINUTE_SIN, minute_of_day), ("minute_cos", MINUTE_COS, minute_of_day),
+        ("weekday_sin", WEEKDAY_SIN, weekday), ("weekday_cos", WEEKDAY_COS, weekday),
+        ("month_sin", MONTH_SIN, months % 12), ("month_cos", MONTH_COS, months % 12),
+    ]
+    for row, (column, table, index) in zip(features, lookups):
+        np.take(table, index, out=row)
+        df[column] = row
 
     return df
 
 
 class FeatureEngineering:
-    def __init__(self, event_data, weather_data):
+    def __init__(self, event_data, weather_data, distance_cache=None):
+        # Events can be given as a slice of the shared EventIndex or as a raw DataFrame
+        if not isinstance(event_data, EventIndex):
+            event_data = EventIndex.from_frame(event_data)
         self.event_data = event_data
         self.weather_data = weather_data
+        # Sensor to venue distances, shared with other FeatureEngineering instances and kept between runs
+        self.distance_cache = distance_cache if distance_cache is not None else get_distance_cache()
+        self._venues = None
 
     def add_weather_features(self, df):
         weather_df = pd.DataFrame(self.weather_data["hourly"])
@@ -68,35 +120,125 @@ class FeatureEngineering:
         return df
 
 
-    def add_event_features(self, df):
-        # Event feature engineering parameters
-        TIME_WINDOW_HOURS = 12  # look for events within 12 hours before/after
-        DISTANCE_WINDOW_KM = 3  # look for events within 3 km
-        DEFAULT_DISTANCE = 100.0
-        DEFAULT_TIME_DIFF = 100.0
-
+    def _add_empty_event_features(self, df, window_hours=(TIME_WINDOW_HOURS,)):
         # If no events in time-frame
+        df["event_min_distance"] = DEFAULT_DISTANCE
+        df["event_min_time_diff"] = DEFAULT_TIME_DIFF
+        df["event_type"] = None
+        df["has_event"] = 0
+        for hours in window_hours:
+            if hours != TIME_WINDOW_HOURS:
+                df[f"event_min_distance_{hours}h"] = DEFAULT_DISTANCE
+                df[f"event_min_time_diff_{hours}h"] = DEFAULT_TIME_DIFF
+                df[f"has_event_{hours}h"] = 0
+        df = pd.get_dummies(df, columns=["event_type"], prefix="evt")
+        for col in ["evt_match", "evt_concert"]:
+            if col not in df.columns:
+                df[col] = 0
+        print("NONE")
+        return df
+
+    def _venue_lookup(self):
+        # Spatial index over the distinct event locations and the venue of every event, built once per instance
+        if self._venues is None:
+            event_locations = np.column_stack([self.event_data.lats, self.event_data.lons])
+            venues, venue_of_event = np.unique(event_locations, axis=0, return_inverse=True)
+            self._venues = get_venue_index(venues), venue_of_event.reshape(-1)
+        return self._venues
+
+    def _nearby_events(self, row_loc):
+        # Events within DISTANCE_WINDOW_KM of a (lat, lon) point and their geodesic distances (km). Only the venues the
+        # spatial index returns as candidates are measured.
+        venue_index, venue_of_event = self._venue_lookup()
+        candidates = venue_index.candidates(row_loc, DISTANCE_WINDOW_KM)
+        venue_distances = np.full(len(venue_index), np.inf)
+        venue_distances[candidates] = self.distance_cache.distances(row_loc, venue_index.points[candidates])
+        nearby = np.flatnonzero(venue_distances[venue_of_event] <= DISTANCE_WINDOW_KM)
+        return nearby, venue_distances[venue_of_event[nearby]]
+
+    def add_event_features(self, df, window_hours=(TIME_WINDOW_HOURS,)):
+        # For every row, the event closest in time within TIME_WINDOW_HOURS among the events within DISTANCE_WINDOW_KM
+        # of the row location. Other windows in window_hours add the same features with a suffix, e.g.
+        # event_min_distance_6h.
+        if self.event_data.empty:
+            return self._add_empty_event_features(df, window_hours)
+
+        event_features = pd.DataFrame(self.event_feature_arrays(df, window_hours), index=df.index)
+        df = pd.concat([df, event_features], axis=1)
+        df = pd.get_dummies(df, columns=["event_type"], prefix="evt")
+        for col in ["evt_match", "evt_concert"]:
+            if col not in df.columns:
+                df[col] = 0
+        return df
+
+    def event_feature_arrays(self, df, window_hours=(TIME_WINDOW_HOURS,)):
+        # The event features of add_event_features as arrays, with the chosen event type instead of dummies.
+        # Rows are handled per distinct location with one sweep over rows and events.
+        row_times = pd.to_datetime(df["_time"])
+        if row_times.dt.tz is not None:
+            row_times = row_times.dt.tz_convert("UTC").dt.tz_localize(None)
+        row_times = row_times.astype("datetime64[ns]").to_numpy().view(np.int64)
+
+        event_times = self.event_data.times
+        event_types = self.event_data.event_types
+
+        windows = sorted(set(window_hours) | {TIME_WINDOW_HOURS})
+        min_distance = {hours: np.full(len(df), DEFAULT_DISTANCE) for hours in windows}
+        min_time_diff = {hours: np.full(len(df), DEFAULT_TIME_DIFF) for hours in windows}
+        has_event = {hours: np.zeros(len(df), dtype=bool) for hours in windows}
+        chosen_type = np.full(len(df), None, dtype=object)
+
+        codes, locations = pd.factorize(df["location"])
+        for code, location in enumerate(locations):
+            row_loc = ast.literal_eval(location)
+            # Swap order as our data is (lat, lon) but geopy expects (lon, lat)
+            if len(row_loc) == 2:
+                row_loc = (row_loc[1], row_loc[0])
+
+            nearby, nearby_distances = self._nearby_events(row_loc)
+            if len(nearby) == 0:
+                continue
+
+            rows = np.flatnonzero(codes == code)
+            times = row_times[rows]
+            nearby_times = event_times[nearby]
+
+            for hours, chosen in nearest_events_within(times, nearby_times, windows).items():
+                found = chosen != NO_EVENT
+                found_rows, chosen = rows[found], chosen[found]
+                min_distance[hours][found_rows] = nearby_distances[chosen]
+                min_time_diff[hours][found_rows] = ((nearby_times[chosen] - times[found]).astype("timedelta64[ns]")
+                                                    / np.timedelta64(1, "h"))
+                has_event[hours][found_rows] = True
+                if hours == TIME_WINDOW_HOURS:
+                    chosen_type[found_rows] = event_types[nearby[chosen]]
+
+        features = {
+            "event_min_distance": min_distance[TIME_WINDOW_HOURS],
+            "event_min_time_diff": min_time_diff[TIME_WINDOW_HOURS],
+            "event_type": chosen_type,
+            "has_event": has_event[TIME_WINDOW_HOURS],
+        }
+        for hours in window_hours:
+            if hours != TIME_WINDOW_HOURS:
+                features[f"event_min_distance_{hours}h"] = min_distance[hours]
+                features[f"event_min_time_diff_{hours}h"] = min_time_diff[hours]
+                features[f"has_event_{hours}h"] = has_event[hours]
+        return features
+
+    def add_event_features_rowwise(self, df):
+        # Original row-by-row implementation, kept as the reference for add_event_features
         if self.event_data.empty:
-            df["event_min_distance"] = DEFAULT_DISTANCE
-            df["event_min_time_diff"] = DEFAULT_TIME_DIFF
-            df["event_type"] = None
-            df["has_event"] = 0
-            df = pd.get_dummies(df, columns=["event_type"], prefix="evt")
-            for col in ["evt_match", "evt_concert"]:
-                if col not in df.columns:
-                    df[col] = 0
-            print("NONE")
-            return df
+            return self._add_empty_event_features(df)
 
         # --- Precompute event data arrays ---
-        event_times = self.event_data["_time"].to_numpy(dtype="datetime64[ns]")
+        event_times = self.event_data.times.view("datetime64[ns]")
 
-        event_locations = self.event_data["location"].apply(ast.literal_eval).tolist()
-        event_locations = np.array(event_locations)
+        event_locations = np.column_stack([self.event_data.lats, self.event_data.lons])
 
-        event_types = self.event_data["event_type"].to_numpy()
+        event_types = self.event_data.event_types
 
-        # event_values = self.event_data["estimated_attendance"].to_numpy()
+        # event_values = self.event_data.attendance
 
         def compute_event_features(row):
             row_time = row["_time"]
@@ -160,14 +302,19 @@ class FeatureEngineering:
                 "has_event": min_distance != DEFAULT_DISTANCE,
             })
 
-        # Run all this processing in parallel on multiple cores for optimised performance
-        num_cores = multiprocessing.cpu_count()
-        df_chunks = np.array_split(df, num_cores)
-        results = Parallel(n_jobs=num_cores, backend='loky')(
-            delayed(lambda chunk: chunk.apply(compute_event_features, axis=1))(chunk)
-            for chunk in df_chunks
-        )
-        event_features = pd.concat(results)
+        # Run all this processing in parallel on the CPUs the process may use (not every CPU of the host), with at
+        # least PARALLEL_MIN_ROWS rows per worker. Small inputs such as a single prediction day are processed here, as
+        # starting the workers would take longer than the work.
+        num_cores = min(available_cpus(), len(df) // PARALLEL_MIN_ROWS)
+        if num_cores <= 1:
+            event_features = df.apply(compute_event_features, axis=1)
+        else:
+            df_chunks = np.array_split(df, num_cores)
+            results = Parallel(n_jobs=num_cores, backend='loky')(
+                delayed(lambda chunk: chunk.apply(compute_event_features, axis=1))(chunk)
+                for chunk in df_chunks
+            )
+            event_features = pd.concat(results)
 
         # Merge the new features with the original DataFrame.
         df = pd.concat([df, event_features], axis=1)
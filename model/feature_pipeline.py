@@ -0,0 +1,177 @@
+"""
+This module contains the FeaturePipeline class, a declarative and lazy version of the feature engineering.
+
+Every feature declares the columns it produces, the columns it needs and how it is computed. A pipeline is built from
+the input schema of a model (see MODEL_SCHEMAS) and only computes the features that schema needs, together with the
+features those depend on. Training and prediction build their inputs from the same schema, so they always get the same
+columns in the same order.
+"""
+
+import ast
+
+import numpy as np
+import pandas as pd
+
+from model.feature_engineering import (
+    FeatureEngineering, wall_clock_ns, NS_PER_DAY, NS_PER_MINUTE, HOUR_SIN, HOUR_COS, MINUTE_SIN, MINUTE_COS,
+    WEEKDAY_SIN, WEEKDAY_COS, MONTH_SIN, MONTH_COS,
+)
+
+TIME_FEATURES = ["year", "day", "hour_sin", "hour_cos", "minute_sin", "minute_cos", "weekday_sin", "weekday_cos",
+                 "month_sin", "month_cos"]
+EVENT_FEATURES = ["event_min_distance", "event_min_time_diff", "has_event", "evt_concert", "evt_match"]
+WEATHER_FEATURES = ["wth_rel_hum", "wth_precip", "wth_wind"]
+LOCATION_FEATURES = ["sensor_lat", "sensor_lon"]
+
+# Input columns of each model, in order. The model trained on many sensors (FFNN_MULTI) also gets the location of the
+# sensor, so that it can tell the sensors apart instead of fitting one profile to all of them.
+MODEL_SCHEMAS = {
+    "FFNN": TIME_FEATURES + EVENT_FEATURES,
+    "FFNN_MULTI": TIME_FEATURES + EVENT_FEATURES + LOCATION_FEATURES,
+    "LSTM": ["value"] + TIME_FEATURES,
+}
+
+
+class Feature:
+    def __init__(self, columns, inputs, compute, sources=()):
+        self.columns = columns  # Columns produced
+        self.inputs = inputs  # Columns needed, from the input frame or from other features
+        self.compute = compute  # compute(frame, pipeline) -> {column: array}
+        self.sources = sources  # External data needed, "events" and/or "weather" of the pipeline
+
+
+def _epoch(frame, pipeline):
+    return {"_wall_ns": wall_clock_ns(frame.source["_time"])}
+
+
+def _calendar(frame, pipeline):
+    times = frame["_wall_ns"]
+    return {
+        "_minute_of_day": times // NS_PER_MINUTE % (24 * 60),
+        "_days": times // NS_PER_DAY,
+        "_months": times.view("datetime64[ns]").astype("datetime64[M]").astype(np.int64),  # months since 1970-01
+    }
+
+
+def _year_day(frame, pipeline):
+    months, days = frame["_months"], frame["_days"]
+    return {
+        "year": (months // 12 + 1970).astype(np.int32),
+        "day": (days - months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + 1).astype(np.int32),
+    }
+
+
+def _cyclic(name, sin_table, cos_table, index):
+    def compute(frame, pipeline):
+        positions = index(frame)
+        return {f"{name}_sin": sin_table[positions], f"{name}_cos": cos_table[positions]}
+    return compute
+
+
+def _sensor_location(frame, pipeline):
+    # Sensor locations are "[lon, lat]", each distinct location is parsed once
+    locations = pd.Categorical(frame.source["location"])
+    lon_lat = np.array([ast.literal_eval(str(location)) for location in locations.categories],
+                       dtype=np.float64).reshape(-1, 2)
+    return {"sensor_lat": lon_lat[locations.codes, 1], "sensor_lon": lon_lat[locations.codes, 0]}
+
+
+def _events(frame, pipeline):
+    fe = FeatureEngineering(pipeline.events, None, pipeline.distance_cache)
+    features = fe.event_feature_arrays(frame.source[["_time", "location"]].reset_index(drop=True))
+    features["_event_type"] = features.pop("event_type")
+    return features
+
+
+def _weather(frame, pipeline):
+    # add_weather_features sorts the rows, they are put back in their original order
+    fe = FeatureEngineering(pipeline.events, pipeline.weather, pipeline.distance_cache)
+    rows = pd.DataFrame({"_time": frame["_wall_ns"].view("datetime64[ns]"), "_row": np.arange(len(frame))})
+    weather = fe.add_weather_features(rows).sort_values("_row")
+    return {column: weather[column].to_numpy() for column in WEATHER_FEATURES}
+
+
+FEATURES = [
+    Feature(["_wall_ns"], ["_time"], _epoch),
+    Feature(["_minute_of_day", "_days", "_months"], ["_wall_ns"], _calendar),
+    Feature(["year", "day"], ["_days", "_months"], _year_day),
+    Feature(["hour_sin", "hour_cos"], ["_minute_of_day"],
+            _cyclic("hour", HOUR_SIN, HOUR_COS, lambda frame: frame["_minute_of_day"])),
+    Feature(["minute_sin", "minute_cos"], ["_minute_of_day"],
+            _cyclic("minute", MINUTE_SIN, MINUTE_COS, lambda frame: frame["_minute_of_day"])),
+    # 1970-01-01 was a Thursday
+    Feature(["weekday_sin", "weekday_cos"], ["_days"],
+            _cyclic("weekday", WEEKDAY_SIN, WEEKDAY_COS, lambda frame: (frame["_days"] + 3) % 7)),
+    Feature(["month_sin", "month_cos"], ["_months"],
+            _cyclic("month", MONTH_SIN, MONTH_COS, lambda frame: frame["_months"] % 12)),
+    Feature(["event_min_distance", "event_min_time_diff", "has_event", "_event_type"], ["_time", "location"], _events,
+            sources=("events",)),
+    # The weather of the sensor location, the location itself is only used to query it
+    Feature(WEATHER_FEATURES, ["_wall_ns", "location"], _weather, sources=("weather",)),
+    Feature(LOCATION_FEATURES, ["location"], _sensor_location),
+]
+
+
+class _LazyFrame:
+    # Columns of the input frame and computed features, each feature is computed once when first needed
+    def __init__(self, source, pipeline):
+        self.source = source
+        self.pipeline = pipeline
+        self.values = {}
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, column):
+        if column not in self.values:
+            if column.startswith("evt_"):
+                # Event type dummies, for any event type
+                self.values[column] = self["_event_type"] == column[len("evt_"):]
+            elif column in self.pipeline.producers:
+                self.values.update(self.pipeline.producers[column].compute(self, self.pipeline))
+            else:
+                self.values[column] = self.source[column].to_numpy()
+        return self.values[column]
+
+
+class FeaturePipeline:
+    def __init__(self, schema, events=None, weather=None, distance_cache=None, features=FEATURES):
+        # schema is a list of columns or the name of a model in MODEL_SCHEMAS
+        self.columns = list(MODEL_SCHEMAS[schema] if isinstance(schema, str) else schema)
+        self.events = events
+        self.weather = weather
+        self.distance_cache = distance_cache
+        self.producers = {column: feature for feature in features for column in feature.columns}
+
+    def _dependencies(self):
+        # Every column the schema depends on, computed or from the input frame
+        pending, seen = list(self.columns), set()
+        while pending:
+            column = pending.pop()
+            if column in seen:
+                continue
+            seen.add(column)
+            if column.startswith("evt_"):
+                pending.append("_event_type")
+            elif column in self.producers:
+                pending.extend(self.producers[column].inputs)
+        return seen
+
+    def required_inputs(self):
+        # Columns of the input frame the schema depends on
+        return {column for column in self._dependencies()
+                if not column.startswith("evt_") and column not in self.producers}
+
+    def required_sources(self):
+        # External data the schema depends on ("events", "weather"), the rest need not be fetched
+        return {source for column in self._dependencies() if column in self.producers
+                for source in self.producers[column].sources}
+
+    def transform(self, df, keep=("_time", "value")):
+        # The schema columns, after the keep columns of the input frame that are not part of the schema
+        frame = _LazyFrame(df, self)
+        keep = [column for column in keep if column in df.columns and column not in self.columns]
+        result = pd.DataFrame({column: df[column] for column in keep}, index=df.index)
+        for column in self.columns:
+            result[column] = frame[column]
+        return result
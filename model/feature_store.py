@@ -0,0 +1,184 @@
+"""
+This module contains the FeatureStore class, an on-disk store of engineered feature matrices per sensor and day.
+
+For every (sensor, day, feature version) the store keeps the feature matrix as a .npy file, the row times as a second
+.npy file and a fingerprint of the inputs the features were computed from: the traffic rows of the day, the sensor
+location and the events that can affect the day. Only days whose fingerprint changed are recomputed, and stored days are
+served back as memory-mapped arrays. Training and prediction use separate stores (see the name argument), as the
+prediction rows are a generated 5 minute grid rather than the measured traffic.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from model.event_index import to_epoch_ns
+from model.feature_engineering import TIME_WINDOW_HOURS
+from model.feature_pipeline import FeaturePipeline
+from tools.config import CACHE_DIR
+
+FEATURE_VERSION = 4  # Increase when the feature engineering changes, stored features of older versions are not used
+DAY_NS = 24 * 60 * 60 * 10**9
+EVENT_MARGIN_NS = TIME_WINDOW_HOURS * 60 * 60 * 10**9  # Events this close to a day affect its features
+
+
+def engineer_features(traffic, events, weather=None, distance_cache=None, schema="FFNN"):
+    # The feature engineering shared by training and prediction: _time, value and the model input columns
+    return FeaturePipeline(schema, events, weather, distance_cache).transform(traffic)
+
+
+def _epoch_ns(times):
+    if pd.api.types.is_integer_dtype(times):
+        return times.to_numpy(dtype=np.int64)
+    times = pd.to_datetime(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    return times.astype("datetime64[ns]").to_numpy().view(np.int64)
+
+
+def _union_columns(column_lists):
+    # Columns in first-seen order, with the event type dummies sorted at the end
+    columns = []
+    for column_list in column_lists:
+        columns += [column for column in column_list if column not in columns]
+    return [column for column in columns if not column.startswith("evt_")] + \
+        sorted(column for column in columns if column.startswith("evt_"))
+
+
+def _fingerprint(times, values, location, events):
+    digest = hashlib.sha1()
+    digest.update(str(FEATURE_VERSION).encode())
+    digest.update(str(location).encode())
+    digest.update(np.ascontiguousarray(times, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(events.times, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(events.lats, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(events.lons, dtype=np.float64).tobytes())
+    digest.update("\n".join(str(event_type) for event_type in events.event_types).encode())
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    def __init__(self, root=None, name="train", version=FEATURE_VERSION):
+        self.root = os.path.join(root or CACHE_DIR, "features", name)
+        self.version = version
+
+    def _sensor_dir(self, platform_id, sensor_id):
+        return os.path.join(self.root, platform_id, sensor_id, f"v{self.version}")
+
+    def _manifest_path(self, platform_id, sensor_id):
+        return os.path.join(self._sensor_dir(platform_id, sensor_id), "manifest.json")
+
+    def manifest(self, platform_id, sensor_id):
+        path = self._manifest_path(platform_id, sensor_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _save_manifest(self, platform_id, sensor_id, manifest):
+        path = self._manifest_path(platform_id, sensor_id)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def update(self, platform_id, sensor_id, traffic, events, weather=None, distance_cache=None):
+        # Recompute the features of the days in traffic whose inputs changed. events is the shared EventIndex.
+        # Returns the number of days recomputed.
+        if traffic is None or traffic.empty:
+            return 0
+        os.makedirs(self._sensor_dir(platform_id, sensor_id), exist_ok=True)
+        manifest = self.manifest(platform_id, sensor_id)
+
+        times = _epoch_ns(traffic["_time"])
+        order = np.argsort(times, kind="stable")
+        traffic, times = traffic.iloc[order], times[order]
+        days = times // DAY_NS
+        bounds = np.flatnonzero(np.diff(days)) + 1
+
+        recomputed = 0
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(days)]):
+            day_start = int(days[lo]) * DAY_NS
+            day = pd.Timestamp(day_start, unit="ns").strftime("%Y-%m-%d")
+            day_events = events.slice(day_start - EVENT_MARGIN_NS, day_start + DAY_NS + EVENT_MARGIN_NS)
+            location = traffic["location"].iloc[lo] if "location" in traffic.columns else None
+            fingerprint = _fingerprint(times[lo:hi], traffic["value"].to_numpy()[lo:hi], location, day_events)
+            if manifest.get(day, {}).get("fingerprint") == fingerprint:
+                continue
+
+            features = engineer_features(traffic.iloc[lo:hi].copy(), day_events, weather, distance_cache)
+            columns = [column for column in features.columns if column != "_time"]
+            matrix = features[columns].to_numpy(dtype=np.float32)
+            np.save(os.path.join(self._sensor_dir(platform_id, sensor_id), f"{day}.npy"), matrix)
+            np.save(os.path.join(self._sensor_dir(platform_id, sensor_id), f"{day}.time.npy"), times[lo:hi])
+            manifest[day] = {"fingerprint": fingerprint, "columns": columns, "rows": int(hi - lo)}
+            recomputed += 1
+
+        self._save_manifest(platform_id, sensor_id, manifest)
+        if distance_cache is not None:
+            distance_cache.flush()
+        return recomputed
+
+    def load_day(self, platform_id, sensor_id, day, manifest=None):
+        # Memory-mapped (times, matrix) and the column names for one stored day (YYYY-MM-DD)
+        entry = (manifest or self.manifest(platform_id, sensor_id))[day]
+        sensor_dir = self._sensor_dir(platform_id, sensor_id)
+        times = np.load(os.path.join(sensor_dir, f"{day}.time.npy"), mmap_mode="r")
+        matrix = np.load(os.path.join(sensor_dir, f"{day}.npy"), mmap_mode="r")
+        return times, matrix, entry["columns"]
+
+    def _days(self, manifest, start, stop):
+        # Stored days with rows in [start, stop), epoch ns
+        first_day = pd.Timestamp(start // DAY_NS * DAY_NS, unit="ns").strftime("%Y-%m-%d")
+        last_day = pd.Timestamp((stop - 1) // DAY_NS * DAY_NS, unit="ns").strftime("%Y-%m-%d")
+        return sorted(day for day in manifest if first_day <= day <= last_day)
+
+    def columns(self, platform_id, sensor_id, start_date, end_date):
+        # Columns of the days stored in [start_date, end_date), with the event type dummies of any of them
+        manifest = self.manifest(platform_id, sensor_id)
+        days = self._days(manifest, to_epoch_ns(start_date), to_epoch_ns(end_date))
+        return _union_columns(manifest[day]["columns"] for day in days)
+
+    def iter_days(self, platform_id, sensor_id, start_date, end_date, columns=None):
+        """
+        Stored features of the rows in [start_date, end_date), one day at a time as (times, matrix) with a float32
+        matrix on columns (default: the columns of the range). A day stored with exactly these columns is served as a
+        view of its memory-mapped file, other days are copied onto the columns (missing event type dummies are 0).
+        """
+        manifest = self.manifest(platform_id, sensor_id)
+        start, stop = to_epoch_ns(start_date), to_epoch_ns(end_date)
+        days = self._days(manifest, start, stop)
+        if columns is None:
+            columns = _union_columns(manifest[day]["columns"] for day in days)
+
+        for day in days:
+            times, matrix, day_columns = self.load_day(platform_id, sensor_id, day, manifest)
+            # Rows of a day are stored in time order
+            lo, hi = np.searchsorted(times, [start, stop])
+            times, matrix = times[lo:hi], matrix[lo:hi]
+            if list(day_columns) != list(columns) or matrix.dtype != np.float32:
+                positions = {column: i for i, column in enumerate(day_columns)}
+                day_matrix = np.zeros((len(times), len(columns)), dtype=np.float32)
+                for i, column in enumerate(columns):
+                    if column in positions:
+                        day_matrix[:, i] = matrix[:, positions[column]]
+                matrix = day_matrix
+            yield times, matrix
+
+    def load(self, platform_id, sensor_id, start_date, end_date, columns=None):
+        # Stored features of the rows in [start_date, end_date) as a float32 DataFrame with a datetime _time column.
+        # Days are put on one set of columns (missing event type dummies are 0), or on the given columns. Callers that
+        # can work one day at a time should use iter_days, which does not copy the stored days.
+        if columns is None:
+            columns = self.columns(platform_id, sensor_id, start_date, end_date)
+        parts = list(self.iter_days(platform_id, sensor_id, start_date, end_date, columns))
+        if not parts:
+            return pd.DataFrame(columns=["_time"] + list(columns))
+
+        matrix = np.concatenate([day_matrix for _, day_matrix in parts])
+        df = pd.DataFrame(matrix, columns=list(columns), copy=False)
+        df.insert(0, "_time", np.concatenate([times for times, _ in parts]).view("datetime64[ns]"))
+        return df
@@ -3,13 +3,201 @@ This module contains the ModelTrainer class, which is responsible for training t
 """
 
 import json
+import math
+import os
+import subprocess
+import sys
+import time
 
+import joblib
+import numpy as np
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout, Input
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping
 import keras_tuner as kt
 
+from model.datasets import ArrayDataset, WindowedSeries
+from model.parallel import available_cpus
+from tools.config import TUNER_EPOCH_BUDGET, TUNER_ORACLE_PORT, TUNER_STRATEGY, TUNER_WORKERS
+
+TUNER_DIRECTORY = "tuner_results"  # Relative to the working directory, as the scripts are run from model/
+TUNER_PROJECT = "traffic_ffnn"
+TUNER_DATA_DIR = os.path.join(TUNER_DIRECTORY, TUNER_PROJECT + "_data")  # Training data shared with tuner workers
+CHIEF_EXIT_TIMEOUT = 120  # Seconds the oracle gets to finish after the last worker is done
+PROCESS_POLL_INTERVAL = 1  # Seconds between checks of the tuner processes
+MAX_EPOCHS = 50  # Epochs of a fully trained configuration
+RANDOM_SEARCH_TRIALS = 100  # Trials of the random search when there is no epoch budget
+HYPERBAND_FACTOR = 3  # Hyperband keeps the best 1/factor of the configurations of each round
+TRIAL_RECORD = "trial_epochs.json"  # Epochs trained and end time of a trial, in its trial directory
+
+
+def hyperband_epochs(max_epochs, factor=HYPERBAND_FACTOR):
+    # Trial-epochs of one Hyperband iteration, with the bracket and round sizes of keras-tuner's HyperbandOracle.
+    # Promoted configurations continue from their last epoch, so each round only adds the epochs in between.
+    brackets, epochs = 0, max_epochs
+    while epochs >= 1:
+        epochs /= factor
+        brackets += 1
+
+    bracket0_end_size = math.ceil(1 + math.log(max_epochs, factor))
+    total = 0
+    for bracket in range(brackets):
+        previous_epochs = 0
+        for round_num in range(bracket + 1):
+            size = math.ceil(bracket0_end_size / (bracket + 1) * factor ** (bracket - round_num))
+            round_epochs = math.ceil(max_epochs / factor ** (bracket - round_num))
+            total += size * (round_epochs - previous_epochs)
+            previous_epochs = round_epochs
+    return total
+
+
+class _TimedSearch:
+    # Records the epochs each trial trained and when it ended in its trial directory, and reports the trial-epochs
+    # used and how long the search took to find its best configuration (see report_search)
+    def on_search_begin(self):
+        super().on_search_begin()
+        self.search_started = time.time()
+        self.best_score = None
+        self.trial_epochs = 0
+
+    def run_trial(self, trial, *args, **kwargs):
+        # One History per execution of the trial. Early stopping can end a fit before its last epoch and Hyperband
+        # resumes promoted configurations from their last epoch, so only the epochs in the histories are counted.
+        histories = super().run_trial(trial, *args, **kwargs)
+        epochs = sum(len(history.history.get("val_loss", [])) for history in histories
+                     if hasattr(history, "history"))
+        self.trial_epochs += epochs
+        with open(os.path.join(self.get_trial_dir(trial.trial_id), TRIAL_RECORD), "w") as f:
+            json.dump({"epochs": epochs, "end": time.time()}, f)
+        return histories
+
+    def on_trial_end(self, trial):
+        super().on_trial_end(trial)
+        # The score is only known here when the oracle runs in this process, in a parallel search the parent reports
+        if trial.score is not None and (self.best_score is None or
+                                        self.oracle.objective.better_than(trial.score, self.best_score)):
+            self.best_score = trial.score
+            print(f"New best val_loss {trial.score:.5f} after {time.time() - self.search_started:.0f}s "
+                  f"and {self.trial_epochs} trial-epochs")
+
+    def on_search_end(self):
+        super().on_search_end()
+        if "KERASTUNER_ORACLE_IP" not in os.environ:
+            report_search(self, self.search_started)
+
+
+class TimedRandomSearch(_TimedSearch, kt.RandomSearch):
+    pass
+
+
+class TimedHyperband(_TimedSearch, kt.Hyperband):
+    pass
+
+
+def report_search(tuner, started):
+    """
+    Print the trial-epochs and time used by the search since started (epoch seconds), and how many of them it took to
+    find its best configuration, from the records of the trials in the tuner directory and their scores in the oracle.
+    Trials of earlier searches in the same directory are not counted.
+    """
+    finished = []
+    for trial_id, trial in tuner.oracle.trials.items():
+        path = os.path.join(tuner.get_trial_dir(trial_id), TRIAL_RECORD)
+        if trial.score is None or not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            record = json.load(f)
+        if record["end"] >= started:
+            finished.append((record["end"], record["epochs"], trial.score))
+    if not finished:
+        return
+
+    epochs, best_score, best = 0, None, None
+    for end, trial_epochs, score in sorted(finished):
+        epochs += trial_epochs
+        if best_score is None or tuner.oracle.objective.better_than(score, best_score):
+            best_score, best = score, (end - started, epochs)
+    print(f"Search took {finished[-1][0] - started:.0f}s and {epochs} trial-epochs over {len(finished)} trials, the "
+          f"best configuration (val_loss {best_score:.5f}) was found after {best[0]:.0f}s and {best[1]} trial-epochs")
+
+
+def _core_slices(workers):
+    # Disjoint sets of the usable CPU cores, one per worker
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    cpus = cpus[:available_cpus()]
+    return [[int(cpu) for cpu in cores] for cores in np.array_split(cpus, min(workers, len(cpus)))]
+
+
+def _tuner_env(tuner_id, threads):
+    # keras-tuner's distributed mode is configured through environment variables, TensorFlow's thread pools are sized
+    # to the cores of the process
+    env = dict(os.environ)
+    env.update({
+        "KERASTUNER_TUNER_ID": tuner_id,
+        "KERASTUNER_ORACLE_IP": "127.0.0.1",
+        "KERASTUNER_ORACLE_PORT": str(TUNER_ORACLE_PORT),
+        "TF_NUM_INTRAOP_THREADS": str(threads),
+        "TF_NUM_INTEROP_THREADS": "1",
+        "OMP_NUM_THREADS": str(threads),
+    })
+    return env
+
+
+def _start_tuner_process(tuner_id, cores=None):
+    threads = len(cores) if cores is not None else 1
+    pin = cores is not None and hasattr(os, "sched_setaffinity")
+    return subprocess.Popen([sys.executable, "-m", "model.tuner_worker", TUNER_DATA_DIR],
+                            env=_tuner_env(tuner_id, threads),
+                            preexec_fn=(lambda: os.sched_setaffinity(0, cores)) if pin else None)
+
+
+def run_parallel_search(data, workers, strategy="random", epoch_budget=None):
+    """
+    Run the FFNN hyperparameter search in worker processes, each pinned to its own cores, sharing one oracle (served
+    by a chief process) and the tuner directory. Data read from a feature file is memory-mapped by the workers from
+    that file, only the positions of its rows are written. Other data is written once and memory-mapped by the
+    workers, together with the scalers of the dataset.
+    """
+    os.makedirs(TUNER_DATA_DIR, exist_ok=True)
+    pass_rows = data.feature_file is not None and data.rows is not None
+    if pass_rows:
+        np.save(os.path.join(TUNER_DATA_DIR, "rows.npy"), data.rows)
+    elif data.feature_file is None:
+        X, y = (data.X, data.y) if data.rows is None else (data.X[data.rows], data.y[data.rows])
+        np.save(os.path.join(TUNER_DATA_DIR, "X.npy"), X)
+        np.save(os.path.join(TUNER_DATA_DIR, "y.npy"), y)
+        joblib.dump((data.x_scaler, data.y_scaler), os.path.join(TUNER_DATA_DIR, "scalers.pkl"))
+    with open(os.path.join(TUNER_DATA_DIR, "data.json"), "w") as f:
+        json.dump({"batch_size": data.batch_size, "split_index": data.split_index, "strategy": strategy,
+                   "epoch_budget": epoch_budget, "feature_file": data.feature_file, "rows": pass_rows}, f)
+
+    chief = _start_tuner_process("chief")
+    processes = [_start_tuner_process(f"tuner{i}", cores) for i, cores in enumerate(_core_slices(workers))]
+
+    # Workers block on the oracle, so they are stopped if the chief dies first (e.g. the oracle port is in use)
+    while any(process.poll() is None for process in processes):
+        if chief.poll() not in (None, 0):
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+            for process in processes:
+                process.wait()
+            raise RuntimeError(f"Tuner chief exited with code {chief.returncode}, see its output above")
+        time.sleep(PROCESS_POLL_INTERVAL)
+    failed = [i for i, process in enumerate(processes) if process.returncode != 0]
+
+    try:
+        chief.wait(timeout=CHIEF_EXIT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        chief.terminate()
+        chief.wait()
+    if failed:
+        raise RuntimeError(f"Tuner workers {failed} failed, see their output above")
+
 
 class ModelTrainer:
     def __init__(self, model_type="LSTM"):
@@ -38,23 +226,63 @@ class ModelTrainer:
         model.compile(optimizer=hp.Choice('optimizer', ['adam', 'rmsprop']), loss='mse')
         return model
 
-    def train_ffnn(self, X_train, y_train):
-        self.data_shape = X_train.shape
+    def ffnn_tuner(self, strategy="random", epoch_budget=None):
+        # epoch_budget is the total number of trial-epochs the search may use, None for the default search size
+        if strategy == "random":
+            return TimedRandomSearch(
+                self.build_ffnn,
+                objective='val_loss',
+                max_trials=max(1, epoch_budget // MAX_EPOCHS) if epoch_budget else RANDOM_SEARCH_TRIALS,
+                executions_per_trial=1,
+                directory=TUNER_DIRECTORY,
+                project_name=TUNER_PROJECT
+            )
 
-        tuner = kt.RandomSearch(
-            self.build_ffnn,
-            objective='val_loss',
-            max_trials=100,
-            executions_per_trial=1,
-            directory='tuner_results',
-            project_name='traffic_ffnn'
-        )
+        if strategy == "hyperband":
+            # As many iterations as fit in the budget, with fewer epochs per configuration if not even one fits
+            max_epochs, iterations = MAX_EPOCHS, 1
+            if epoch_budget:
+                while max_epochs > HYPERBAND_FACTOR and hyperband_epochs(max_epochs) > epoch_budget:
+                    max_epochs -= 1
+                iterations = max(1, epoch_budget // hyperband_epochs(max_epochs))
+            print(f"Hyperband: {iterations} iteration(s) of up to {max_epochs} epochs per configuration, "
+                  f"{iterations * hyperband_epochs(max_epochs)} trial-epochs")
+            return TimedHyperband(
+                self.build_ffnn,
+                objective='val_loss',
+                max_epochs=max_epochs,
+                factor=HYPERBAND_FACTOR,
+                hyperband_iterations=iterations,
+                directory=TUNER_DIRECTORY,
+                project_name=TUNER_PROJECT + "_hyperband"
+            )
+
+        raise ValueError(f"Unknown tuning strategy {strategy}")
 
+    def search_ffnn(self, tuner, data):
+        # Hyperband sets the epochs of each trial itself
         early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
+        tuner.search(data.train(), validation_data=data.validation(), epochs=MAX_EPOCHS, callbacks=[early_stopping])
 
-        tuner.search(X_train, y_train, epochs=50, batch_size=256, validation_split=0.2, callbacks=
-            [early_stopping])
+    def train_ffnn(self, X_train, y_train=None, workers=None, strategy=None, epoch_budget=None):
+        # With more than one worker the trials run in parallel processes (see run_parallel_search). strategy is
+        # "random" or "hyperband" (successive halving), epoch_budget caps the trial-epochs of the search.
+        data = X_train if isinstance(X_train, ArrayDataset) else ArrayDataset(X_train, y_train, batch_size=256)
+        self.data_shape = data.shape
+        workers = workers or TUNER_WORKERS
+        strategy = strategy or TUNER_STRATEGY
+        epoch_budget = epoch_budget or TUNER_EPOCH_BUDGET
 
+        if workers > 1:
+            started = time.time()
+            run_parallel_search(data, workers, strategy, epoch_budget)
+            tuner = self.ffnn_tuner(strategy, epoch_budget)  # Reloads the finished search from the tuner directory
+            report_search(tuner, started)
+        else:
+            tuner = self.ffnn_tuner(strategy, epoch_budget)
+            self.search_ffnn(tuner, data)
+
+        early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
         best_hps = tuner.get_best_hyperparameters(num_trials=1)[0]
 
         best_hps_dict = best_hps.values
@@ -65,13 +293,18 @@ class ModelTrainer:
             json.dump(best_hps_dict, f, indent=4)
 
         best_model = tuner.hypermodel.build(best_hps)
-        best_model.fit(X_train, y_train, epochs=50, batch_size=256, validation_split=0.2, callbacks=[early_stopping])
+        best_model.fit(data.train(), validation_data=data.validation(), epochs=MAX_EPOCHS, callbacks=[early_stopping])
 
         return best_model
 
-    def train_lstm(self, X_train, y_train):
+    def train_lstm(self, X_train, y_train=None):
+        # X_train can be the windows of sliding_windows or a WindowedSeries, windows are only copied batch by batch
+        if isinstance(X_train, (ArrayDataset, WindowedSeries)):
+            data = X_train
+        else:
+            data = ArrayDataset(X_train, y_train, batch_size=64)
         model = Sequential([
-            Input(shape=(X_train.shape[1], X_train.shape[2])),
+            Input(shape=(data.shape[1], data.shape[2])),
 
             LSTM(100, return_sequences=True),
             Dropout(0.1),
@@ -94,16 +327,16 @@ class ModelTrainer:
         )
 
         model.fit(
-            X_train,
-            y_train,
+            data.train(),
+            validation_data=data.validation(),
             epochs=50,
-            batch_size=64,
-            validation_split=0.2,
             callbacks=[early_stopping]
         )
         return model
 
-    def train_model(self, X_train, y_train):
+    def train_model(self, X_train, y_train=None):
+        # X_train and y_train are arrays (in memory or memory-mapped), or X_train is an ArrayDataset (or a
+        # WindowedSeries for the LSTM)
         if self.model_type == "LSTM":
             return self.train_lstm(X_train, y_train)
         elif self.model_type == "FFNN":
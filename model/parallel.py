@@ -0,0 +1,47 @@
+"""
+This module contains available_cpus, the number of CPUs the process can actually use for parallel work.
+
+It is limited by the CPU affinity of the process and the CPU quota of the container (cgroup v1 or v2), unlike
+multiprocessing.cpu_count() which counts every CPU of the host. The parallel hyperparameter search (see
+model_training.py) and the row-wise event features (see feature_engineering.py) size their workers with it.
+"""
+
+import os
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read().split()
+
+
+def _cgroup_cpu_quota():
+    # Number of CPUs allowed by the cgroup CPU quota, None if there is no quota
+    try:
+        quota, period = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        quota = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")[0])  # cgroup v1
+        period = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")[0])
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def available_cpus():
+    # CPUs this process can actually use, unlike multiprocessing.cpu_count() which counts every CPU of the host
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        count = min(count, int(quota))
+    return max(1, count)
@@ -4,7 +4,7 @@ Used for further analysis, visualisation and simulation purposes.
 """
 
 import ast
-from datetime import datetime
+from datetime import datetime, timedelta
 import joblib
 import numpy as np
 import pandas as pd
@@ -12,7 +12,9 @@ import matplotlib.pyplot as plt
 from tensorflow.keras.models import load_model
 
 from model.data_loader import DataLoader, query_weather_data
-from model.feature_engineering import FeatureEngineering, remove_unused_columns, add_time_features
+from model.distance_cache import get_distance_cache
+from model.event_index import get_event_index
+from model.feature_store import FeatureStore
 
 
 def predict_model(start_date, end_date, platform_id, sensor_id, model_date_range=None):
@@ -24,7 +26,7 @@ def predict_model(start_date, end_date, platform_id, sensor_id, model_date_range
     traffic['value'] = 0.0
 
     loader = DataLoader()
-    events = loader.query_event_data(start_date, end_date)
+    events = get_event_index(loader.backend)
     traffic['location'] = loader.lookup_sensor_location(platform_id, sensor_id)
 
     lon, lat = ast.literal_eval(traffic["location"].iloc[0])
@@ -32,18 +34,9 @@ def predict_model(start_date, end_date, platform_id, sensor_id, model_date_range
     loader.close()
 
     # --- Feature Engineering ---
-    fe = FeatureEngineering(events, weather)
-    df = add_time_features(traffic)
-    df = fe.add_event_features(df)
-    # df = fe.add_weather_features(df)
-    df = remove_unused_columns(df)
-
-    # Sort and keep a copy
-    df = df.sort_values(by="_time")
-    dates = df["_time"].copy()
-    df = df.drop(columns=['_time'])
-
-    X = df.drop(columns=["value"]).values
+    # Features of the generated grid are kept in their own store, only days with new events are recomputed
+    store = FeatureStore(name="predict")
+    store.update(platform_id, sensor_id, traffic, events, weather, distance_cache=get_distance_cache())
 
     if model_date_range is None:
         model_start_date = start_date.strftime('%Y-%m-%d')
@@ -59,10 +52,19 @@ def predict_model(start_date, end_date, platform_id, sensor_id, model_date_range
     x_scaler = joblib.load(x_scaler_path)
     y_scaler = joblib.load(y_scaler_path)
 
-    # Scale and predict
-    X_scaled = x_scaler.transform(X)
-    y_pred_scaled = model.predict(X_scaled)
-    y_pred = y_scaler.inverse_transform(y_pred_scaled).flatten()
+    # Scale and predict one stored day at a time, the features are read from the store's memory-mapped files. The
+    # grid includes end_date itself.
+    stop_date = end_date + timedelta(microseconds=1)
+    columns = store.columns(platform_id, sensor_id, start_date, stop_date)
+    feature_indexes = [i for i, column in enumerate(columns) if column != "value"]
+    dates, y_pred = [], []
+    for times, matrix in store.iter_days(platform_id, sensor_id, start_date, stop_date, columns):
+        X_scaled = x_scaler.transform(matrix[:, feature_indexes])
+        y_pred_scaled = model.predict(X_scaled, verbose=0)
+        y_pred.append(y_scaler.inverse_transform(y_pred_scaled).flatten())
+        dates.append(times.view("datetime64[ns]"))
+    y_pred = np.concatenate(y_pred)
+    dates = pd.Series(np.concatenate(dates))
 
     y_pred = np.round(y_pred * 0.621371, 2) # Convert m/s to mph
 
@@ -0,0 +1,208 @@
+"""
+This module contains the SensorCatalog class, an on-disk index of the traffic sensors stored in InfluxDB.
+
+For every sensor it keeps the platform, sensor id, type, direction, location, first/last seen times and the number of
+valid data points per calendar month. The catalog is built once from the storage backend, cached as JSON and refreshed
+incrementally, so metadata lookups do not need to scan the raw traffic data.
+"""
+
+import ast
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from model.spatial_index import MAX_CACHED_QUERIES, SpatialIndex
+from tools.config import CACHE_DIR, SENSOR_CATALOG_MAX_AGE_HOURS
+
+DIRECTIONS = {"n", "ne", "e", "se", "s", "sw", "w", "nw"}
+
+_catalog = None
+
+
+def sensor_uid(platform_id, sensor_id):
+    return platform_id + "__" + sensor_id
+
+
+def sensor_direction(sensor_id):
+    # e.g. avgspeed_nw -> nw
+    direction = sensor_id.split("_")[-1].lower()
+    return direction if direction in DIRECTIONS else None
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def location_lat_lon(location):
+    # Sensor locations are stored as "[lon, lat]"
+    lon, lat = ast.literal_eval(location)
+    return float(lat), float(lon)
+
+
+def _next_month(month_start):
+    if month_start.month == 12:
+        return month_start.replace(year=month_start.year + 1, month=1)
+    return month_start.replace(month=month_start.month + 1)
+
+
+class SensorCatalog:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "sensor_catalog.json")
+        self.refreshed = None
+        self.entries = {}
+        self._sensor_index = None
+        self._nearby_venues = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.refreshed = datetime.fromisoformat(data["refreshed"])
+            self.entries = data["sensors"]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"refreshed": self.refreshed.isoformat(), "sensors": self.entries}, f, indent=2)
+
+    def is_stale(self, max_age_hours=SENSOR_CATALOG_MAX_AGE_HOURS):
+        return self.refreshed is None or _utc_now() - self.refreshed > timedelta(hours=max_age_hours)
+
+    def refresh(self, backend):
+        # Only re-scan from the start of the month of the last refresh, older months are final
+        now = _utc_now()
+        if self.refreshed is None:
+            since = datetime(1970, 1, 1)
+        else:
+            since = datetime(self.refreshed.year, self.refreshed.month, 1)
+
+        # One row per sensor, location and month with the number of points and the first and last of them
+        summary = backend.traffic_summary(since, now)
+
+        # Months since the last refresh are replaced, not added to, as they were counted in full again
+        recounted = set()
+        for row in summary.itertuples(index=False):
+            location = row.location if isinstance(row.location, str) else None
+            entry = self._entry(row.platform_id, row.sensor_id, row.sensor_type, location)
+            first_seen, last_seen = row.first.isoformat(), row.last.isoformat()
+            if entry["first_seen"] is None or first_seen < entry["first_seen"]:
+                entry["first_seen"] = first_seen
+            if entry["last_seen"] is None or last_seen > entry["last_seen"]:
+                entry["last_seen"] = last_seen
+                entry["location"] = location
+
+            month = row.month.strftime("%Y-%m")
+            if (entry["uid"], month) not in recounted:
+                entry["monthly_counts"][month] = 0
+                recounted.add((entry["uid"], month))
+            entry["monthly_counts"][month] += int(row.count)
+
+        for entry in self.entries.values():
+            entry["sample_count"] = sum(entry["monthly_counts"].values())
+
+        self.refreshed = now
+        self._sensor_index = None
+        self._nearby_venues = {}
+        self.save()
+        print(f"Sensor catalog refreshed with {len(self.entries)} sensors.")
+
+    def _entry(self, platform_id, sensor_id, sensor_type, location):
+        uid = sensor_uid(platform_id, sensor_id)
+
+        if uid not in self.entries:
+            self.entries[uid] = {
+                "uid": uid,
+                "platform_id": platform_id,
+                "sensor_id": sensor_id,
+                "sensor_type": sensor_type,
+                "direction": sensor_direction(sensor_id),
+                "location": location,
+                "first_seen": None,
+                "last_seen": None,
+                "sample_count": 0,
+                "monthly_counts": {},
+            }
+        return self.entries[uid]
+
+    def get(self, platform_id, sensor_id):
+        return self.entries.get(sensor_uid(platform_id, sensor_id))
+
+    def location(self, platform_id, sensor_id):
+        entry = self.get(platform_id, sensor_id)
+        return entry["location"] if entry is not None else None
+
+    def sensors(self, sensor_type=None, active_since=None):
+        result = []
+        for entry in self.entries.values():
+            if sensor_type is not None and entry["sensor_type"] != sensor_type:
+                continue
+            if active_since is not None and (entry["last_seen"] is None or entry["last_seen"] < active_since.isoformat()):
+                continue
+            result.append(entry)
+        return result
+
+    def sensor_index(self):
+        # Spatial index over the sensors with a known location, keyed by (platform_id, sensor_id)
+        if self._sensor_index is None:
+            keys, points = [], []
+            for entry in self.entries.values():
+                if entry["location"] is None:
+                    continue
+                try:
+                    points.append(location_lat_lon(entry["location"]))
+                except (ValueError, SyntaxError, TypeError):
+                    continue
+                keys.append((entry["platform_id"], entry["sensor_id"]))
+            self._sensor_index = SpatialIndex(points, keys)
+        return self._sensor_index
+
+    def sensors_near(self, lat, lon, radius_km):
+        # (platform_id, sensor_id) and haversine distance (km) of the sensors within radius_km, nearest first
+        return self.sensor_index().keys_within((lat, lon), radius_km)
+
+    def venues_near(self, platform_id, sensor_id, venue_index, radius_km):
+        # Positions in venue_index and haversine distances (km) of the venues within radius_km of a sensor, kept until
+        # the next refresh (at most MAX_CACHED_QUERIES, the oldest is dropped first)
+        key = (sensor_uid(platform_id, sensor_id), venue_index, float(radius_km))
+        if key not in self._nearby_venues:
+            location = self.location(platform_id, sensor_id)
+            if location is None:
+                return [], []
+            if len(self._nearby_venues) >= MAX_CACHED_QUERIES:
+                del self._nearby_venues[next(iter(self._nearby_venues))]
+            self._nearby_venues[key] = venue_index.within(location_lat_lon(location), radius_km)
+        return self._nearby_venues[key]
+
+    def sample_count(self, platform_id, sensor_id, start_date, end_date):
+        # Counts are kept per calendar month, a month only partly inside [start_date, end_date) is counted in
+        # proportion to the part of it covered, assuming its points are spread evenly over the time the sensor reported
+        entry = self.get(platform_id, sensor_id)
+        if entry is None or entry["first_seen"] is None:
+            return 0
+        first_seen = datetime.fromisoformat(entry["first_seen"])
+        last_seen = datetime.fromisoformat(entry["last_seen"])
+
+        total = 0.0
+        for month, count in entry["monthly_counts"].items():
+            month_start = datetime.strptime(month, "%Y-%m")
+            month_end = _next_month(month_start)
+            if month_start >= end_date or month_end <= start_date:
+                continue
+            if start_date <= month_start and month_end <= end_date:
+                total += count
+                continue
+            # The points of the month lie between the first and the last time the sensor was seen
+            span_start, span_end = max(month_start, first_seen), min(month_end, last_seen + timedelta(microseconds=1))
+            span = (span_end - span_start).total_seconds()
+            covered = (min(span_end, end_date) - max(span_start, start_date)).total_seconds()
+            if span > 0 and covered > 0:
+                total += count * covered / span
+        return int(round(total))
+
+def get_sensor_catalog(backend, max_age_hours=SENSOR_CATALOG_MAX_AGE_HOURS):
+    # One catalog per process, loaded from disk and refreshed when it is older than max_age_hours
+    global _catalog
+    if _catalog is None:
+        _catalog = SensorCatalog()
+    if _catalog.is_stale(max_age_hours):
+        _catalog.refresh(backend)
+    return _catalog
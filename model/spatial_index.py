@@ -0,0 +1,64 @@
+"""
+This module contains the SpatialIndex class, a BallTree over (lat, lon) points in the haversine metric.
+
+It answers "points within R km of a location" in logarithmic time, e.g. the venues near a sensor or the sensors near a
+venue. Haversine distances are on a sphere and differ from the geodesic (ellipsoid) distances used for the features by
+less than 0.6%, so the index is searched with a slightly larger radius and the candidates are checked against the exact
+distances (see DistanceCache). Results are memoized per location and radius, as sensors and venues do not move, up to
+MAX_CACHED_QUERIES per index.
+"""
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371.0088
+HAVERSINE_TOLERANCE = 1.01  # Search radius factor covering the difference between haversine and geodesic distances
+MAX_VENUE_INDEXES = 64  # Event slices of different periods can have different venue sets
+MAX_CACHED_QUERIES = 4096  # Memoized results per index, the oldest is dropped first
+
+_venue_indexes = {}
+
+
+class SpatialIndex:
+    def __init__(self, points, keys=None):
+        # points are (lat, lon) in degrees, keys identify each point (defaults to its position)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.keys = list(keys) if keys is not None else list(range(len(self.points)))
+        self.tree = BallTree(np.radians(self.points), metric="haversine") if len(self.points) else None
+        self._results = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def within(self, point, radius_km):
+        # Positions and haversine distances (km) of the points within radius_km of a (lat, lon) point, nearest first
+        key = (float(point[0]), float(point[1]), float(radius_km))
+        if key not in self._results:
+            if len(self._results) >= MAX_CACHED_QUERIES:
+                del self._results[next(iter(self._results))]
+            if self.tree is None:
+                self._results[key] = (np.array([], dtype=np.int64), np.array([]))
+            else:
+                positions, distances = self.tree.query_radius(np.radians([point[:2]]), r=radius_km / EARTH_RADIUS_KM,
+                                                              return_distance=True, sort_results=True)
+                self._results[key] = (positions[0].astype(np.int64), distances[0] * EARTH_RADIUS_KM)
+        return self._results[key]
+
+    def candidates(self, point, radius_km):
+        # Positions of the points that can be within radius_km geodesic distance of a (lat, lon) point
+        return self.within(point, radius_km * HAVERSINE_TOLERANCE)[0]
+
+    def keys_within(self, point, radius_km):
+        positions, distances = self.within(point, radius_km)
+        return [(self.keys[position], float(distance)) for position, distance in zip(positions, distances)]
+
+
+def get_venue_index(venues):
+    # One index per set of distinct venue (lat, lon) locations, shared by every feature engineering run in the process
+    venues = np.ascontiguousarray(venues, dtype=np.float64)
+    key = venues.tobytes()
+    if key not in _venue_indexes:
+        if len(_venue_indexes) >= MAX_VENUE_INDEXES:
+            del _venue_indexes[next(iter(_venue_indexes))]
+        _venue_indexes[key] = SpatialIndex(venues)
+    return _venue_indexes[key]
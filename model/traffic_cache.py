@@ -0,0 +1,128 @@
+"""
+This module contains the TrafficCache class, a local read-through cache for traffic data queried from InfluxDB.
+
+Data is stored as parquet files partitioned by platform, sensor and month, alongside a coverage file recording which
+time ranges have already been fetched. Full frames and projected frames (see DataLoader.query_traffic_data) are kept
+in separate directories as their schemas differ. The DataLoader uses it so that only missing time ranges are queried.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from tools.config import CACHE_DIR
+
+
+def _month_starts(start_time, stop_time):
+    # First day of every month overlapping [start_time, stop_time)
+    current = datetime(start_time.year, start_time.month, 1)
+    while current < stop_time:
+        yield current
+        if current.month == 12:
+            current = current.replace(year=current.year + 1, month=1)
+        else:
+            current = current.replace(month=current.month + 1)
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _schema_name(columns):
+    if columns is None:
+        return "full"
+    return "-".join(["value"] + sorted(columns))
+
+
+def _to_utc(times):
+    # Projected frames store _time as int64 epoch nanoseconds
+    if pd.api.types.is_integer_dtype(times):
+        return pd.to_datetime(times, unit="ns", utc=True)
+    times = pd.to_datetime(times)
+    if times.dt.tz is None:
+        return times.dt.tz_localize("UTC")
+    return times.dt.tz_convert("UTC")
+
+
+class TrafficCache:
+    def __init__(self, root=None):
+        self.root = os.path.join(root or CACHE_DIR, "traffic")
+
+    def _sensor_dir(self, platform_id, sensor_id, columns=None):
+        return os.path.join(self.root, platform_id, sensor_id, _schema_name(columns))
+
+    def _partition_path(self, platform_id, sensor_id, month, columns=None):
+        return os.path.join(self._sensor_dir(platform_id, sensor_id, columns), f"{month.strftime('%Y-%m')}.parquet")
+
+    def _coverage_path(self, platform_id, sensor_id, columns=None):
+        return os.path.join(self._sensor_dir(platform_id, sensor_id, columns), "coverage.json")
+
+    def coverage(self, platform_id, sensor_id, columns=None):
+        path = self._coverage_path(platform_id, sensor_id, columns)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            ranges = json.load(f)
+        return [(datetime.fromisoformat(start), datetime.fromisoformat(stop)) for start, stop in ranges]
+
+    def missing_ranges(self, platform_id, sensor_id, start_time, stop_time, columns=None):
+        missing = []
+        current = start_time
+        for start, stop in self.coverage(platform_id, sensor_id, columns):
+            if stop <= current:
+                continue
+            if start >= stop_time:
+                break
+            if start > current:
+                missing.append((current, start))
+            current = max(current, stop)
+        if current < stop_time:
+            missing.append((current, stop_time))
+        return missing
+
+    def store(self, platform_id, sensor_id, start_time, stop_time, df, columns=None):
+        os.makedirs(self._sensor_dir(platform_id, sensor_id, columns), exist_ok=True)
+
+        if df is not None and not df.empty:
+            months = _to_utc(df["_time"]).dt.tz_localize(None).dt.to_period("M")
+
+            for month, month_df in df.groupby(months):
+                path = self._partition_path(platform_id, sensor_id, month.to_timestamp(), columns)
+                if os.path.exists(path):
+                    month_df = pd.concat([pd.read_parquet(path), month_df], ignore_index=True)
+                    month_df = month_df.drop_duplicates(subset="_time", keep="last")
+                month_df.sort_values("_time").to_parquet(path, index=False)
+
+        # Never mark the future as covered, data may still arrive for it
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        stop_time = min(stop_time, now)
+        if start_time >= stop_time:
+            return
+
+        ranges = self.coverage(platform_id, sensor_id, columns) + [(start_time, stop_time)]
+        with open(self._coverage_path(platform_id, sensor_id, columns), "w") as f:
+            json.dump([[start.isoformat(), stop.isoformat()] for start, stop in _merge_ranges(ranges)], f)
+
+    def iter_load(self, platform_id, sensor_id, start_time, stop_time, columns=None):
+        # Cached traffic in [start_time, stop_time), one monthly partition at a time
+        start, stop = pd.Timestamp(start_time, tz="UTC"), pd.Timestamp(stop_time, tz="UTC")
+        for month in _month_starts(start_time, stop_time):
+            path = self._partition_path(platform_id, sensor_id, month, columns)
+            if os.path.exists(path):
+                df = pd.read_parquet(path)
+                times = _to_utc(df["_time"])
+                yield df[(times >= start) & (times < stop)].reset_index(drop=True)
+
+    def load(self, platform_id, sensor_id, start_time, stop_time, columns=None):
+        frames = list(self.iter_load(platform_id, sensor_id, start_time, stop_time, columns))
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True)
@@ -4,12 +4,14 @@ This script trains an LSTM model to predict traffic speed using historical traff
 
 from datetime import datetime
 import numpy as np
-import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
 
 from model.data_loader import DataLoader
-from model.feature_engineering import FeatureEngineering, add_time_features
+from model.datasets import WindowedSeries
+from model.event_index import get_event_index
+from model.feature_pipeline import FeaturePipeline
 from model.model_training import ModelTrainer
+from model.windowing import sliding_windows
 from model.evaluation import Evaluator
 import matplotlib.pyplot as plt
 
@@ -20,16 +22,21 @@ sensor_id = "avgspeed_nw"
 platform_id = "drakewell__1163"
 
 loader = DataLoader()
-traffic = loader.batch_query_traffic(start_date, end_date, 7, platform_id, sensor_id)
-events = loader.query_event_data(start_date, end_date)
+# Short gaps (up to 30 minutes) are interpolated so that windows cover evenly spaced observations
+traffic = loader.query_sensor_series(start_date, end_date, platform_id, sensor_id)
+traffic = traffic.fill_gaps(method="linear", limit=6)
 
 # === Feature Engineering ===
-fe = FeatureEngineering(events, None)
-df = add_time_features(traffic)
-#df = fe.add_event_features(df)
+# Only the columns in the LSTM input schema are computed, and events are only loaded if the schema uses them. Gaps
+# longer than the fill limit are kept as rows, so that every window covers consecutive 5 minute steps.
+pipeline = FeaturePipeline("LSTM")
+if "events" in pipeline.required_sources():
+    pipeline.events = get_event_index(loader.backend).slice(start_date, end_date)
+df = pipeline.transform(traffic.to_frame(include_invalid=True))
+valid = traffic.valid
 
 df = df.sort_values(by="_time")
-df = df.drop(columns=['_time', "result", "table", "_start", "_stop", "_measurement", "location", "platform_description", "platform_id", "platform_label", "sensor_id", "sensor_type", "unit"])
+df = df.drop(columns=['_time'])
 
 # Make a copy of the original date-time values for plotting later
 feature_columns = df.drop(columns=["value"]).columns.tolist()
@@ -37,42 +44,37 @@ feature_columns = df.drop(columns=["value"]).columns.tolist()
 print("Columns after feature engineering:")
 print(df.columns)
 
-# Create time-series window data
-def create_time_series_data(df, target_col, window_size=5):
-    X, y = [], []
-    for i in range(len(df) - window_size):
-        window_data = df.iloc[i:i + window_size].values
-        X.append(window_data)
-        y.append(df.iloc[i + window_size][target_col])
-    return np.array(X, dtype=np.float32), np.array(y, dtype=np.float32)
-
-
 window_size = 60  # Use x many past observations to predict the next observation
 
+# Scaling ignores the gaps (NaN), windows containing a gap are left out below
 scaler = MinMaxScaler()
-scaled_data = scaler.fit_transform(df)
-df = pd.DataFrame(scaled_data, columns=df.columns)
+scaled_data = scaler.fit_transform(df).astype(np.float32)
+value_index = df.columns.get_loc("value")
 
-X, y = create_time_series_data(df, target_col="value", window_size=window_size)
+# Windows are views on scaled_data, only the test windows are copied
+X, y, usable = sliding_windows(scaled_data, window_size, value_index, valid=valid)
 
 # Train-test split
 split_ratio = 0.8
 split_index = int(len(X) * split_ratio)
 
-X_train, X_test = X[:split_index], X[split_index:]
-y_train, y_test = y[:split_index], y[split_index:]
+# The training windows are cut from the rows of the first split_index windows one batch at a time
+train_rows = split_index + window_size
+train_data = WindowedSeries(scaled_data[:train_rows], window_size, value_index, valid=valid[:train_rows])
+X_test, y_test = X[split_index:][usable[split_index:]], y[split_index:][usable[split_index:]]
 
-print(f"Training data shape: {X_train.shape}")
+print(f"Training data shape: {train_data.shape}")
 print(f"Testing data shape: {X_test.shape}")
 
 # Debug prints to verify the values and types
-print("X_train sample (first window):", X_train[0])
-print("y_train sample (first 5 targets):", y_train[:20])
-print("X_train dtype:", X_train.dtype)
-print("y_train dtype:", y_train.dtype)
+X_sample, y_sample = train_data.train()[0]
+print("X_train sample (first window of a training batch):", X_sample[0])
+print("y_train sample (first 20 targets of a training batch):", y_sample[:20].flatten())
+print("X_train dtype:", X_sample.dtype)
+print("y_train dtype:", y_sample.dtype)
 
 trainer = ModelTrainer(model_type="LSTM")
-model = trainer.train_model(X_train, y_train)
+model = trainer.train_model(train_data)
 
 y_pred = model.predict(X_test)
 evaluator = Evaluator(y_test, y_pred)
@@ -2,6 +2,7 @@
 This script trains a neural network model on the traffic data and saves the model and scalers.
 """
 import ast
+import os
 from datetime import datetime
 
 import joblib
@@ -9,15 +10,26 @@ import numpy as np
 from matplotlib import pyplot as plt
 from sklearn.preprocessing import RobustScaler
 
+from model.chunked_features import build_feature_file
 from model.data_loader import DataLoader, query_weather_data
-from model.feature_engineering import FeatureEngineering, remove_unused_columns, add_time_features
+from model.datasets import ArrayDataset
+from model.distance_cache import get_distance_cache
+from model.event_index import get_event_index
+from model.feature_store import FeatureStore
+from model.sensor_series import SensorSeries
 from model.model_training import ModelTrainer
 from model.evaluation import Evaluator
+from tools.config import CACHE_DIR
 
-def train_model(start_date, end_date, platform_id, sensor_id):
+def train_model(start_date, end_date, platform_id, sensor_id, traffic=None):
     loader = DataLoader()
-    traffic = loader.batch_query_traffic(start_date, end_date, 7, platform_id, sensor_id)
-    events = loader.query_event_data(start_date, end_date)
+    # Traffic can be passed in when it has already been fetched, e.g. by a bulk query in batch_training.py,
+    # either as a traffic frame or as a SensorSeries
+    if traffic is None:
+        traffic = loader.batch_query_traffic(start_date, end_date, 7, platform_id, sensor_id, columns=["location"])
+    elif isinstance(traffic, SensorSeries):
+        traffic = traffic.to_frame()
+    events = get_event_index(loader.backend)
 
     lon, lat = ast.literal_eval(traffic["location"].iloc[0])
     weather = query_weather_data(start_date, end_date, lat, lon)
@@ -25,11 +37,10 @@ def train_model(start_date, end_date, platform_id, sensor_id):
     loader.close()
 
     # === Feature Engineering ===
-    fe = FeatureEngineering(events, weather)
-    df = add_time_features(traffic)
-    df = fe.add_event_features(df)
-    #df = fe.add_weather_features(df)
-    df = remove_unused_columns(df)
+    # Only days with new traffic or events are recomputed, the rest come from the feature store
+    store = FeatureStore()
+    store.update(platform_id, sensor_id, traffic, events, weather, distance_cache=get_distance_cache())
+    df = store.load(platform_id, sensor_id, start_date, end_date)
 
     # Sort, drop and keep copy
     df = df.sort_values(by="_time")
@@ -116,6 +127,39 @@ def train_model(start_date, end_date, platform_id, sensor_id):
     plt.savefig(
         f"plots/model_{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}_{platform_id}_{sensor_id}.png")
 
+def train_multi_sensor_model(start_date, end_date, sensors, chunk_days=None):
+    # One model for all sensors, with the sensor location as an input (see MODEL_SCHEMAS). Features are engineered out
+    # of core into a memory-mapped feature file and read from it one batch at a time, scaled with statistics gathered
+    # while the file was written, so memory does not grow with the number of sensors or the length of the history.
+    name = f"{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}_multi"
+    path = os.path.join(CACHE_DIR, "features", "multi", name)
+    kwargs = {"chunk_days": chunk_days} if chunk_days else {}
+    rows = build_feature_file(start_date, end_date, sensors, path, schema="FFNN_MULTI", **kwargs)
+    print(f"Engineered {rows} rows of features for {len(sensors)} sensors")
+
+    # Train-test split: the file is written in time order, the last 20% of the rows are held out for evaluation. The
+    # model is trained on the rest, whose own last 20% are the validation rows of early stopping and the tuner.
+    split_index = int(rows * 0.8)
+    data = ArrayDataset.from_feature_file(path, target="value", rows=np.arange(split_index))
+    test = ArrayDataset.from_feature_file(path, target="value", rows=np.arange(split_index, rows),
+                                          validation_fraction=1.0)  # All of its rows, in order
+    trainer = ModelTrainer(model_type="FFNN")
+    model = trainer.train_model(data)
+
+    y_pred = model.predict(test.validation())
+    y_test_unscaled = np.round(test.validation_targets().flatten() * 0.621371, 2)
+    y_pred_unscaled = np.round(test.y_scaler.inverse_transform(y_pred.reshape(-1, 1)).flatten() * 0.621371, 2)
+    metrics = Evaluator(y_test_unscaled, y_pred_unscaled).compute_metrics()
+
+    # === Save the Model and Scalers ===
+    model.save(f"trained/model_{name}.keras")
+    joblib.dump(data.x_scaler, f"scalers/x_scaler_{name}.pkl")
+    joblib.dump(data.y_scaler, f"scalers/y_scaler_{name}.pkl")
+
+    with open("metrics.csv", "a") as f:
+        f.write(f"{start_date.strftime('%Y-%m-%d')},{end_date.strftime('%Y-%m-%d')},multi,{len(sensors)},{metrics['MAE']},{metrics['MSE']},{metrics['MAPE']} \n")
+
+
 if __name__ == "__main__":
     start_date = datetime(2020, 12, 1)
     end_date = datetime(2025, 2, 1)
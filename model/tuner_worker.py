@@ -0,0 +1,40 @@
+"""
+This script runs one process of the parallel FFNN hyperparameter search started by ModelTrainer.train_ffnn.
+
+The role of the process comes from the KERASTUNER_TUNER_ID environment variable: "chief" serves the shared oracle and
+the "tuner<i>" workers run trials. The training data is memory-mapped from the feature file of the parent's dataset, or
+from the directory written by the parent process.
+"""
+
+import json
+import os
+import sys
+
+import joblib
+import numpy as np
+
+from model.datasets import ArrayDataset
+from model.model_training import ModelTrainer
+
+
+def main(data_dir):
+    with open(os.path.join(data_dir, "data.json"), "r") as f:
+        config = json.load(f)
+    if config["feature_file"] is not None:
+        path, target = config["feature_file"]
+        rows = np.load(os.path.join(data_dir, "rows.npy")) if config["rows"] else None
+        data = ArrayDataset.from_feature_file(path, target, batch_size=config["batch_size"], rows=rows)
+    else:
+        X = np.load(os.path.join(data_dir, "X.npy"), mmap_mode="r")
+        y = np.load(os.path.join(data_dir, "y.npy"), mmap_mode="r")
+        x_scaler, y_scaler = joblib.load(os.path.join(data_dir, "scalers.pkl"))
+        data = ArrayDataset(X, y, batch_size=config["batch_size"], x_scaler=x_scaler, y_scaler=y_scaler)
+    data.split_index = config["split_index"]  # The same validation rows as in the parent process
+
+    trainer = ModelTrainer(model_type="FFNN")
+    trainer.data_shape = data.shape
+    trainer.search_ffnn(trainer.ffnn_tuner(config["strategy"], config["epoch_budget"]), data)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
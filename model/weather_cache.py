@@ -0,0 +1,113 @@
+"""
+This module contains the WeatherCache class, a persistent on-disk cache for hourly weather data from the Open-Meteo
+archive.
+
+Data is stored as one JSON file per day, keyed by the latitude and longitude rounded to two decimal places. Only the
+days missing from the cache are fetched, split into chunks that are requested in parallel. In offline mode requests are
+sent to the local fixture server (tools/weather_fixture_server.py) instead of the Open-Meteo API.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+from tools.config import CACHE_DIR, WEATHER_URL, WEATHER_REPLAY_URL, WEATHER_OFFLINE, WEATHER_ARCHIVE_LAG_DAYS
+
+WEATHER_CHUNK_DAYS = 90  # Maximum number of days requested in one call
+WEATHER_FETCH_WORKERS = 4
+
+
+def location_key(lat, lon):
+    return f"{round(float(lat), 2):.2f}_{round(float(lon), 2):.2f}"
+
+
+def _days(start_date, stop_date):
+    # Open-Meteo date ranges include the end date
+    day = start_date.date() if hasattr(start_date, "date") else start_date
+    stop = stop_date.date() if hasattr(stop_date, "date") else stop_date
+    while day <= stop:
+        yield day
+        day += timedelta(days=1)
+
+
+def _chunks(days, chunk_days):
+    # Split days into contiguous runs of at most chunk_days
+    chunk = []
+    for day in days:
+        if chunk and (day - chunk[-1] != timedelta(days=1) or len(chunk) >= chunk_days):
+            yield chunk
+            chunk = []
+        chunk.append(day)
+    if chunk:
+        yield chunk
+
+
+class WeatherCache:
+    def __init__(self, root=None, offline=WEATHER_OFFLINE):
+        self.root = os.path.join(root or CACHE_DIR, "weather")
+        self.url = WEATHER_REPLAY_URL if offline else WEATHER_URL
+
+    def _day_path(self, lat, lon, day):
+        return os.path.join(self.root, location_key(lat, lon), f"{day.isoformat()}.json")
+
+    def _fetch(self, lat, lon, days):
+        endpoint = self.url.format(lat=round(float(lat), 2), lon=round(float(lon), 2),
+                                   start_date=days[0].isoformat(), end_date=days[-1].isoformat())
+        response = requests.get(endpoint)
+        if response.status_code != 200:
+            print(f"Failed to fetch weather data: {response.status_code}")
+            return None
+        return response.json()["hourly"]
+
+    def _store(self, lat, lon, hourly):
+        os.makedirs(os.path.join(self.root, location_key(lat, lon)), exist_ok=True)
+
+        by_day = {}
+        for i, time in enumerate(hourly["time"]):
+            day = by_day.setdefault(time[:10], {key: [] for key in hourly})
+            for key, values in hourly.items():
+                day[key].append(values[i])
+
+        # The archive lags a few days behind, recent days may still change and are not cached. Older days are final,
+        # including any values the archive is missing for them.
+        final_until = (date.today() - timedelta(days=WEATHER_ARCHIVE_LAG_DAYS)).isoformat()
+        for day, values in by_day.items():
+            if day >= final_until:
+                continue
+            with open(os.path.join(self.root, location_key(lat, lon), f"{day}.json"), "w") as f:
+                json.dump(values, f)
+
+        return by_day
+
+    def query(self, start_date, stop_date, lat, lon):
+        days = list(_days(start_date, stop_date))
+        missing = [day for day in days if not os.path.exists(self._day_path(lat, lon, day))]
+
+        fetched = {}
+        if missing:
+            chunks = list(_chunks(missing, WEATHER_CHUNK_DAYS))
+            print(f"Fetching {len(missing)} days of weather data in {len(chunks)} chunks...")
+            with ThreadPoolExecutor(max_workers=WEATHER_FETCH_WORKERS) as executor:
+                results = list(executor.map(lambda chunk: self._fetch(lat, lon, chunk), chunks))
+            if any(result is None for result in results):
+                return None
+            for hourly in results:
+                fetched.update(self._store(lat, lon, hourly))
+
+        hourly = {}
+        for day in days:
+            path = self._day_path(lat, lon, day)
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    values = json.load(f)
+            elif day.isoformat() in fetched:
+                values = fetched[day.isoformat()]
+            else:
+                continue
+            for key, column in values.items():
+                hourly.setdefault(key, []).extend(column)
+
+        return {"latitude": lat, "longitude": lon, "hourly": hourly}
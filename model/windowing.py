@@ -0,0 +1,59 @@
+"""
+This module contains the sliding-window builder for the sequence (LSTM) models.
+
+Windows are strided views on the (rows, features) array, built with numpy's sliding_window_view, so no window is copied
+until a batch of them is read for training (see ArrayDataset). For N rows of F features a 60 step window takes no
+memory on top of the N x F array, instead of an N x 60 x F copy. window_starts gives the start rows of the same windows
+for cutting them on the fly (see WindowedSeries).
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def window_count(rows, window_size, horizon=1, stride=1):
+    # Number of windows whose target row is inside an array of rows
+    return max(0, (rows - window_size - horizon) // stride + 1)
+
+
+def sliding_windows(data, window_size, target_index, horizon=1, stride=1, valid=None):
+    """
+    Windows of window_size consecutive rows of data (rows, features), starting every stride rows, and the target
+    column of the row horizon steps after the end of each window (horizon=1 is the next row). Returns (X, y, mask):
+    X (windows, window_size, features) and y (windows,) are read-only views on data. mask is None if valid (a boolean
+    per row) is not given, otherwise it tells for every window whether all its rows and its target row are valid.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    count = window_count(len(data), window_size, horizon, stride)
+    if count == 0:
+        # Too few rows for a single window, sliding_window_view needs at least window_size rows
+        X, y = np.empty((0, window_size, data.shape[1]), dtype=data.dtype), np.empty(0, dtype=data.dtype)
+        return X, y, None if valid is None else np.zeros(0, dtype=bool)
+
+    # sliding_window_view puts the window axis last, (rows, features, window_size) -> (rows, window_size, features)
+    X = sliding_window_view(data, window_size, axis=0).transpose(0, 2, 1)[:count * stride:stride]
+    first_target = window_size + horizon - 1
+    y = data[first_target:first_target + count * stride:stride, target_index]
+    if valid is None:
+        return X, y, None
+    return X, y, _window_mask(valid, count, window_size, horizon, stride)
+
+
+def _window_mask(valid, count, window_size, horizon, stride):
+    # Invalid rows in each window from a running count, so the mask is O(rows) whatever the window size
+    valid = np.asarray(valid, dtype=bool)
+    invalid_before = np.concatenate([[0], np.cumsum(~valid)])
+    starts = np.arange(count) * stride
+    first_target = window_size + horizon - 1
+    return (invalid_before[starts + window_size] == invalid_before[starts]) & valid[starts + first_target]
+
+
+def window_starts(rows, window_size, horizon=1, stride=1, valid=None):
+    # Start rows of the windows of sliding_windows, only of the windows without invalid rows if valid is given
+    count = window_count(rows, window_size, horizon, stride)
+    starts = np.arange(count, dtype=np.int64) * stride
+    if valid is None:
+        return starts
+    return starts[_window_mask(valid, count, window_size, horizon, stride)]
@@ -5,16 +5,18 @@ This script queries InfluxDB for sensor data and places induction loop sensors o
 import ast
 import math
 import os
-from influxdb_client import InfluxDBClient
+from datetime import datetime, timedelta, timezone
 import sumolib
 import xml.etree.ElementTree as ET
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from model.sensor_catalog import get_sensor_catalog
+from tools.storage import get_backend
 
 ROOT = "base-sim/"
 
 NETWORK_FILE =  ROOT + "osm.net.xml.gz"
 CONFIG_FILE =  ROOT + "osm.sumocfg"
 OUTPUT_FILE = ROOT + "sensors.add.xml"
+LANE_SEARCH_RADIUS = 20  # meters
 
 # Direction mappings for SUMO
 direction_mapping = {
@@ -65,41 +67,29 @@ def get_lane_orientation(lane):
     return angle
 
 def query_sensor_data():
-    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-    query_api = client.query_api()
-    flux_query = f'''
-    from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: -30d)
-      |> filter(fn: (r) => r["_measurement"] == "Traffic")
-      |> filter(fn: (r) => r["sensor_type"] == "vehicle-speed")
-    '''
-    tables = query_api.query(query=flux_query, org=INFLUXDB_ORG)
+    catalog = get_sensor_catalog(get_backend())
+
+    # Only place sensors that have reported in the last 30 days
+    active_since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=30)
     sensors = {}
-    for table in tables:
-        for record in table.records:
-            platform_id = record.values.get("platform_id")
-            sensor_id = record.values.get("sensor_id")
-            # Build a unique key: platform_id__sensor_id
-            uid = platform_id + "__" + sensor_id
-            if sensor_id is None or not sensor_id.startswith("avgspeed_") or uid in sensors:
-                continue
-            parts = sensor_id.split("_")
-            if len(parts) < 2:
-                continue
-            direction = parts[1].lower()
-            if direction not in direction_mapping:
-                print(f"Sensor {uid} has unknown direction: {direction}")
-                continue
-            loc_str = record.values.get("location")
-            try:
-                loc = ast.literal_eval(loc_str)
-                if isinstance(loc, (list, tuple)) and len(loc) == 2:
-                    sensor_coord = (float(loc[0]), float(loc[1]))
-                    sensors[uid] = {"coord": sensor_coord, "direction": direction}
-            except Exception as e:
-                print(f"Error parsing location for sensor {uid}: {loc_str} -> {e}")
-    client.close()
-    print(f"Queried {len(sensors)} sensor records from InfluxDB.")
+    for entry in catalog.sensors(sensor_type="vehicle-speed", active_since=active_since):
+        uid = entry["uid"]
+        sensor_id = entry["sensor_id"]
+        if not sensor_id.startswith("avgspeed_"):
+            continue
+        direction = entry["direction"]
+        if direction not in direction_mapping:
+            print(f"Sensor {uid} has unknown direction: {direction}")
+            continue
+        loc_str = entry["location"]
+        try:
+            loc = ast.literal_eval(loc_str)
+            if isinstance(loc, (list, tuple)) and len(loc) == 2:
+                sensor_coord = (float(loc[0]), float(loc[1]))
+                sensors[uid] = {"coord": sensor_coord, "direction": direction}
+        except Exception as e:
+            print(f"Error parsing location for sensor {uid}: {loc_str} -> {e}")
+    print(f"Queried {len(sensors)} sensor records from the sensor catalog.")
     return sensors
 
 
@@ -150,32 +140,33 @@ def main():
         desired_angle = primary_angle
 
         sensor_found = False
-        # Add a sensor for every lane that qualifies.
-        for edge in net.getEdges():
-            for lane in edge.getLanes():
-                polyline = lane.getShape()
-                dist, pos = point_to_polyline_distance(sensor_xy, polyline)
-                # Only consider lanes within 20 meters.
-                if dist > 20:
-                    continue
-                lane_angle = get_lane_orientation(lane)
-                if lane_angle is None:
-                    continue
-                diff = abs(lane_angle - desired_angle)
-                if diff > 180:
-                    diff = 360 - diff
-                if diff <= 45:
-                    sensor_found = True
-                    # Create a unique detector id for this lane, e.g. sensorID_laneID
-                    detector_id = f"{sensor_id}_{lane.getID()}"
-                    lane_id = lane.getID()
-                    pos_str = f"{pos:.2f}"
-                    xml_entry = (
-                        f'<inductionLoop id="{detector_id}" lane="{lane_id}" pos="{pos_str}" '
-                        f'period="300" file="{sensor_id}.out"/>'
-                    )
-                    sensor_xml_entries.append(xml_entry)
-                    print(f"Placed sensor {detector_id} on lane {lane_id} at pos {pos_str} (dist {dist:.2f}).")
+        # Add a sensor for every lane that qualifies. Candidate lanes come from the network's spatial index
+        # instead of a scan over every lane.
+        nearby_lanes = net.getNeighboringLanes(sensor_xy[0], sensor_xy[1], LANE_SEARCH_RADIUS, includeJunctions=False)
+        for lane, _ in sorted(nearby_lanes, key=lambda item: item[0].getID()):
+            polyline = lane.getShape()
+            dist, pos = point_to_polyline_distance(sensor_xy, polyline)
+            # Only consider lanes within 20 meters.
+            if dist > LANE_SEARCH_RADIUS:
+                continue
+            lane_angle = get_lane_orientation(lane)
+            if lane_angle is None:
+                continue
+            diff = abs(lane_angle - desired_angle)
+            if diff > 180:
+                diff = 360 - diff
+            if diff <= 45:
+                sensor_found = True
+                # Create a unique detector id for this lane, e.g. sensorID_laneID
+                detector_id = f"{sensor_id}_{lane.getID()}"
+                lane_id = lane.getID()
+                pos_str = f"{pos:.2f}"
+                xml_entry = (
+                    f'<inductionLoop id="{detector_id}" lane="{lane_id}" pos="{pos_str}" '
+                    f'period="300" file="{sensor_id}.out"/>'
+                )
+                sensor_xml_entries.append(xml_entry)
+                print(f"Placed sensor {detector_id} on lane {lane_id} at pos {pos_str} (dist {dist:.2f}).")
         if not sensor_found:
             print(f"Could not find any suitable lane for sensor {sensor_id} with direction '{sensor_dir}'.")
 
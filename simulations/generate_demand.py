@@ -5,14 +5,14 @@ This script generates demand files for SUMO simulations based on historical real
 import os
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
-from influxdb_client import InfluxDBClient
+import numpy as np
 import sumolib
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET
+from model.event_index import to_epoch_ns
+from model.sensor_series import SensorSeries, align
+from tools.storage import get_backend
 
-def iso_to_seconds(iso_str):
-    t = datetime.fromisoformat(iso_str.replace("Z", ""))
-    return (t - SIM_START).total_seconds()
+DAY_NS = 24 * 60 * 60 * 10**9
 
 
 def load_sensors_from_xml(xml_file):
@@ -34,80 +34,76 @@ def load_sensors_from_xml(xml_file):
     return sensor_groups
 
 
+def _window_series(chunks, sim_date, scale=1.0):
+    # One SensorSeries per sensor on the 5 minute grid of the simulated day, the mean of the points in each window
+    day_start = to_epoch_ns(datetime.fromisoformat(f"{sim_date}T00:00:00"))
+    step = int(TIME_WINDOW.total_seconds()) * 10**9
+    windows = DAY_NS // step
+    sums, counts = {}, {}
+    for chunk in chunks:
+        for (platform_id, sensor_id), rows in chunk.groupby(["platform_id", "sensor_id"], observed=True):
+            uid = platform_id + "__" + sensor_id
+            slots = (rows["_time"].to_numpy() - day_start) // step
+            inside = (slots >= 0) & (slots < windows)
+            values = rows["value"].to_numpy(dtype=np.float64)[inside]
+            sums[uid] = sums.get(uid, 0) + np.bincount(slots[inside], weights=values, minlength=windows)
+            counts[uid] = counts.get(uid, 0) + np.bincount(slots[inside], minlength=windows)
+
+    series = {}
+    for uid in sums:
+        means = np.where(counts[uid] > 0, sums[uid] / np.maximum(counts[uid], 1), np.nan)
+        series[uid] = SensorSeries(day_start, means * scale, step=step)
+    return series
+
+
+def _as_series(data):
+    # (window_begin, window_end, value) tuples in seconds from the simulation start are also accepted
+    if isinstance(data, SensorSeries):
+        return data
+    times = [round(window_end * 10**9) - 1 for _, window_end, _ in data]
+    values = [value if value is not None else np.nan for _, _, value in data]
+    return SensorSeries.from_arrays(times, values, step=int(TIME_WINDOW.total_seconds()) * 10**9)
+
+
 def query_sensor_count_data(sim_date):
-    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-    query_api = client.query_api()
-    start_time = f"{sim_date}T00:00:00Z"
-    stop_time = f"{sim_date}T23:59:59Z"
-    flux_query = f'''
-    from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: {start_time}, stop: {stop_time})
-      |> filter(fn: (r) => r["_measurement"] == "Traffic")
-      |> filter(fn: (r) => r["sensor_type"] == "vehicle-count")
-      |> aggregateWindow(every: 5m, fn: mean, createEmpty: false)
-      |> duplicate(column: "_stop", as: "time")
-    '''
-    tables = query_api.query(query=flux_query, org=INFLUXDB_ORG)
-    count_data = {}
-    for table in tables:
-        for record in table.records:
-            uid = record.values.get("platform_id") + "__" + record.values.get("sensor_id")
-            count_value = record.get_value()
-            window_end_iso = record.get_time().isoformat()
-            window_end = iso_to_seconds(window_end_iso)
-            window_begin = window_end - TIME_WINDOW.total_seconds()
-            if uid not in count_data:
-                count_data[uid] = []
-            count_data[uid].append((window_begin, window_end, count_value))
-    client.close()
-    for uid in count_data:
-        count_data[uid].sort(key=lambda x: x[0])
-    print(f"Queried count data for {len(count_data)} sensor groups from InfluxDB.")
+    day_start = datetime.fromisoformat(f"{sim_date}T00:00:00")
+    chunks = get_backend().traffic(day_start, day_start + timedelta(days=1), sensor_type="vehicle-count",
+                                   columns=[], positive=False)
+    count_data = _window_series(chunks, sim_date)
+    print(f"Queried count data for {len(count_data)} sensor groups.")
     return count_data
 
 
 def query_sensor_speed_data(sim_date):
-    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-    query_api = client.query_api()
-    start_time = f"{sim_date}T00:00:00Z"
-    stop_time = f"{sim_date}T23:59:59Z"
-    flux_query = f'''
-    from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: {start_time}, stop: {stop_time})
-      |> filter(fn: (r) => r["_measurement"] == "Traffic")
-      |> filter(fn: (r) => r["sensor_type"] == "vehicle-speed")
-      |> aggregateWindow(every: 5m, fn: mean, createEmpty: false)
-      |> duplicate(column: "_stop", as: "time")
-    '''
-    tables = query_api.query(query=flux_query, org=INFLUXDB_ORG)
-    speed_data = {}
-    for table in tables:
-        for record in table.records:
-            uid = record.values.get("platform_id") + "__" + record.values.get("sensor_id")
-            speed_kmh = record.get_value()
-            speed_ms = speed_kmh / 3.6 if speed_kmh is not None else None
-            window_end_iso = record.get_time().isoformat()
-            window_end = iso_to_seconds(window_end_iso)
-            window_begin = window_end - TIME_WINDOW.total_seconds()
-            if uid not in speed_data:
-                speed_data[uid] = []
-            speed_data[uid].append((window_begin, window_end, speed_ms))
-    client.close()
-    for uid in speed_data:
-        speed_data[uid].sort(key=lambda x: x[0])
-    print(f"Queried speed data for {len(speed_data)} sensor groups from InfluxDB.")
+    day_start = datetime.fromisoformat(f"{sim_date}T00:00:00")
+    chunks = get_backend().traffic(day_start, day_start + timedelta(days=1), sensor_type="vehicle-speed",
+                                   columns=[], positive=False)
+    speed_data = _window_series(chunks, sim_date, scale=1 / 3.6)  # km/h to m/s
+    print(f"Queried speed data for {len(speed_data)} sensor groups.")
     return speed_data
 
 
 def generate_data_file(sensor_groups, count_data, speed_data, net):
     data_elem = ET.Element("data")
-    # Use max sensor group number of windows
-    sample_key = max(count_data.keys(), key=lambda x: len(count_data[x]))
-    num_windows = len(count_data[sample_key])
+    # Put all sensors on one time grid, so window i is the same interval for every sensor
+    count_data = {uid: _as_series(data) for uid, data in count_data.items()}
+    speed_data = {uid: _as_series(data) for uid, data in speed_data.items()}
+    aligned = align(list(count_data.values()) + list(speed_data.values()))
+    count_data = dict(zip(count_data, aligned[:len(count_data)]))
+    speed_data = dict(zip(speed_data, aligned[len(count_data):]))
+    count_valid = {uid: series.valid for uid, series in count_data.items()}
+    speed_valid = {uid: series.valid for uid, series in speed_data.items()}
+
+    grid = aligned[0]
+    num_windows = len(grid)
+    # Interval times are seconds from the start of the simulated day
+    day_offset = (grid.start % DAY_NS) / 10**9
+    window_seconds = grid.step / 10**9
     print(f"Generating data for {num_windows} time intervals (5 minutes each).")
 
     for i in range(num_windows):
-        win_begin, win_end, _ = count_data[sample_key][i]
+        win_begin = day_offset + i * window_seconds
+        win_end = win_begin + window_seconds
         interval_elem = ET.SubElement(data_elem, "interval",
                                       id=f"interval_{i}",
                                       begin=f"{win_begin:.1f}",
@@ -116,11 +112,10 @@ def generate_data_file(sensor_groups, count_data, speed_data, net):
             count_key = group_key.replace("avgspeed", "car") # Replace speed with count
             if count_key not in count_data or group_key not in speed_data:
                 continue
-            try:
-                _, _, count_value = count_data[count_key][i]
-                _, _, speed_value = speed_data[group_key][i]
-            except IndexError:
+            if not (count_valid[count_key][i] and speed_valid[group_key][i]):
                 continue
+            count_value = count_data[count_key].values[i]
+            speed_value = speed_data[group_key].values[i]
             # Use the first sensor in the group to get the associated edge id.
             sensor = sensor_list[0]
             lane_id = sensor["lane"]
@@ -180,7 +175,6 @@ if __name__ == "__main__":
         OUTPUT_FILE = ROOT + "demand.xml"
         ROUTES_FILE = ROOT + "routes.rou.xml"
 
-        SIM_START = datetime.fromisoformat(SIMULATION_DATE + "T00:00:00Z")
         TIME_WINDOW = timedelta(minutes=5)
         SCALING_FACTOR = 0.7  # Scale simulation to prevent total network congestion (due to simulation inefficiencies)
 
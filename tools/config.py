@@ -9,6 +9,32 @@ INFLUXDB_URL = ""
 INFLUXDB_TOKEN = ""
 INFLUXDB_ORG = ""
 INFLUXDB_BUCKET = ""
+INFLUXDB_QUERY_WORKERS = 4  # Maximum number of concurrent windowed queries
+INFLUXDB_TIMEOUT_MS = 60000  # Timeout of a single request to InfluxDB
+INFLUXDB_RETRIES = 3  # Retries for failed requests (connection errors and 429/5xx responses)
+INFLUXDB_POOL_SIZE = 10  # Connections kept alive in the shared client's pool
+
+# DataLoader storage backend, "influx" for a live server or "file" for the local files of tools/file_backend.py
+INFLUXDB_BACKEND = "influx"
+FILE_BACKEND_DIR = "file-backend"
 
 WEATHER_URL = "https://archive-api.open-meteo.com/v1/archive?latitude={lat}&longitude={lon}&start_date={start_date}&end_date={end_date}&hourly=relative_humidity_2m,precipitation,wind_speed_10m"
+# Offline mode replays cached weather from tools/weather_fixture_server.py instead of calling Open-Meteo
+WEATHER_OFFLINE = False
+WEATHER_REPLAY_URL = "http://127.0.0.1:8765/v1/archive?latitude={lat}&longitude={lon}&start_date={start_date}&end_date={end_date}"
+WEATHER_FIXTURE_DIR = "weather-fixtures"  # Recorded responses replayed by the fixture server, kept apart from the cache
+WEATHER_ARCHIVE_LAG_DAYS = 5  # Days before today that the archive may not have final values for yet
 OPENROUTER_KEY = ""
+
+# Local directory for cached data (traffic partitions, etc.)
+CACHE_DIR = "cache"
+SENSOR_CATALOG_MAX_AGE_HOURS = 24  # Refresh the sensor catalog when it is older than this
+
+# Hyperparameter search of the FFNN: worker processes running trials in parallel (1 runs them in this process), each
+# pinned to its share of the CPU cores, and the local port of the shared keras-tuner oracle
+TUNER_WORKERS = 1
+TUNER_ORACLE_PORT = 8000
+# "random" or "hyperband" (successive halving of configurations), and the total trial-epochs the search may use
+# (None for 100 random trials or one Hyperband iteration)
+TUNER_STRATEGY = "random"
+TUNER_EPOCH_BUDGET = None
@@ -0,0 +1,144 @@
+"""
+File-backed storage for the DataLoader, used to run and benchmark the pipeline without an InfluxDB server.
+
+Points are stored as InfluxDB stores them, one row per field value (_time, _field, _value and the tags), in parquet
+files partitioned by measurement and calendar month under FILE_BACKEND_DIR, e.g. Traffic/2024-03.parquet. FileBackend
+answers the same calls as InfluxBackend (see tools/storage.py) with pandas and reads only the months a call covers, and
+a write only rewrites the months it touches. Set INFLUXDB_BACKEND = "file" in tools/config.py to use it, and use
+tools/snapshot_influx.py to copy data from a live server into it.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from tools.storage import STREAM_CHUNK_SIZE, SUMMARY_COLUMNS, traffic_frame
+
+POINT_COLUMNS = {"_time", "_field", "_value"}
+
+
+def _naive_utc(time):
+    time = pd.Timestamp(time)
+    return time.tz_convert("UTC").tz_localize(None) if time.tzinfo is not None else time
+
+
+def _pivot(points):
+    # One row per time and tag set with the fields as columns, as Flux's pivot() returns them
+    tags = [column for column in points.columns if column not in POINT_COLUMNS]
+    wide = points.set_index(["_time"] + tags + ["_field"])["_value"].unstack("_field").reset_index()
+    wide.columns.name = None
+    return wide
+
+
+class FileBackend:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _path(self, measurement, month):
+        return os.path.join(self.root, measurement, f"{month}.parquet")
+
+    def _months(self, measurement, start_time=None, stop_time=None):
+        # Stored months of a measurement that overlap [start_time, stop_time)
+        directory = os.path.join(self.root, measurement)
+        if not os.path.isdir(directory):
+            return []
+        months = sorted(pd.Period(name[:-len(".parquet")], freq="M")
+                        for name in os.listdir(directory) if name.endswith(".parquet"))
+        if start_time is not None:
+            months = [month for month in months if month.end_time >= _naive_utc(start_time)]
+        if stop_time is not None:
+            months = [month for month in months if month.start_time < _naive_utc(stop_time)]
+        return months
+
+    def _read(self, measurement, start_time=None, stop_time=None):
+        # Yields the points of each stored month in [start_time, stop_time)
+        for month in self._months(measurement, start_time, stop_time):
+            points = pd.read_parquet(self._path(measurement, month))
+            if start_time is not None:
+                points = points[points["_time"] >= pd.Timestamp(_naive_utc(start_time), tz="UTC")]
+            if stop_time is not None:
+                points = points[points["_time"] < pd.Timestamp(_naive_utc(stop_time), tz="UTC")]
+            yield points
+
+    def traffic(self, start_time, stop_time, sensors=None, columns=None, sensor_type="vehicle-speed", positive=True,
+                chunk_size=STREAM_CHUNK_SIZE):
+        # See InfluxBackend.traffic, only one stored month is read at a time
+        if sensors is not None and not sensors:
+            return
+        wanted = pd.MultiIndex.from_tuples(sensors) if sensors is not None else None
+        for points in self._read("Traffic", start_time, stop_time):
+            if points.empty or "sensor_type" not in points.columns:
+                continue
+            mask = (points["sensor_type"] == sensor_type) & (points["_field"] == "value")
+            if positive:
+                mask &= points["_value"] > 0
+            if wanted is not None:
+                mask &= pd.MultiIndex.from_arrays([points["platform_id"], points["sensor_id"]]).isin(wanted)
+            points = points[mask].rename(columns={"_value": "value"}).sort_values("_time", kind="stable")
+            for start in range(0, len(points), chunk_size):
+                yield traffic_frame(points.iloc[start:start + chunk_size], columns)
+
+    def traffic_summary(self, start_time, stop_time):
+        # See InfluxBackend.traffic_summary, a stored month holds every point of its calendar month
+        keys = SUMMARY_COLUMNS[:4]
+        frames = []
+        for points in self._read("Traffic", start_time, stop_time):
+            points = points[(points["_field"] == "value") & (points["_value"] > 0)]
+            if points.empty:
+                continue
+            times = points["_time"].dt.tz_convert(None)
+            points = points.assign(_time=times, month=times.dt.to_period("M").dt.to_timestamp())
+            grouped = points.groupby(keys + ["month"], dropna=False, observed=True)["_time"]
+            frames.append(grouped.agg(count="count", first="min", last="max").reset_index())
+        if not frames:
+            return pd.DataFrame(columns=SUMMARY_COLUMNS)
+        return pd.concat(frames, ignore_index=True)[SUMMARY_COLUMNS]
+
+    def events(self, start_time=None, stop_time=None):
+        frames = [_pivot(points) for points in self._read("Event", start_time, stop_time) if not points.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def event_summary(self):
+        count, total, last = 0, 0.0, 0
+        for points in self._read("Event"):
+            points = points[points["_field"] == "estimated_attendance"]
+            if not points.empty:
+                count += len(points)
+                total += float(points["_value"].astype(np.float64).sum())
+                last = max(last, int(points["_time"].max().value))
+        return count, total, last
+
+    def write(self, records):
+        rows = []
+        for record in records:
+            time = pd.Timestamp(record["time"]) if record.get("time") is not None else pd.Timestamp.now(tz="UTC")
+            tags = {key: str(value) for key, value in record.get("tags", {}).items()}
+            for field, value in record["fields"].items():
+                rows.append({"_time": time, "_measurement": record["measurement"], "_field": field, "_value": value,
+                             **tags})
+        if rows:
+            self.write_frame(pd.DataFrame(rows))
+
+    def write_frame(self, points):
+        """
+        Store points given as a long frame (_time, _measurement, _field, _value and the tags, e.g. an unpivoted
+        query_data_frame result). Rows with the same tags, field and time replace the stored value, as in InfluxDB.
+        """
+        points = points.drop(columns=["result", "table", "_start", "_stop"], errors="ignore")
+        times = pd.to_datetime(points["_time"], utc=True)
+        points = points.assign(_time=times)
+        months = times.dt.tz_convert(None).dt.to_period("M")
+        with self.lock:
+            for (measurement, month), rows in points.groupby([points["_measurement"], months]):
+                path = self._path(measurement, month)
+                rows = rows.drop(columns="_measurement")
+                if os.path.exists(path):
+                    rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+                key = [column for column in rows.columns if column != "_value"]
+                rows = rows.drop_duplicates(subset=key, keep="last").sort_values("_time", kind="stable")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                rows.reset_index(drop=True).to_parquet(path + ".tmp", index=False)
+                os.replace(path + ".tmp", path)
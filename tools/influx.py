@@ -0,0 +1,47 @@
+"""
+Shared InfluxDB client.
+
+Every script in the project gets its InfluxDB client from get_client(), so HTTP connections are pooled and kept alive
+for the whole process instead of being opened for every query or write. Timeouts, retries and the pool size are set in
+tools/config.py. The client is closed when the process exits.
+
+The DataLoader does not use the client directly but through a storage backend (see tools/storage.py), which can also
+be a local file store.
+"""
+
+import atexit
+import threading
+
+from influxdb_client import InfluxDBClient
+from urllib3 import Retry
+
+from tools.config import (INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_TIMEOUT_MS, INFLUXDB_RETRIES,
+                          INFLUXDB_POOL_SIZE)
+
+_client = None
+_lock = threading.Lock()
+
+
+def create_influx_client():
+    # Queries are sent as POST requests, so retries are allowed on any method
+    retries = Retry(total=INFLUXDB_RETRIES, backoff_factor=0.5, allowed_methods=None,
+                    status_forcelist=[429, 500, 502, 503, 504])
+    return InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG, timeout=INFLUXDB_TIMEOUT_MS,
+                          retries=retries, connection_pool_maxsize=INFLUXDB_POOL_SIZE)
+
+
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = create_influx_client()
+            atexit.register(close_client)
+        return _client
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -5,15 +5,13 @@ on the same and next day.
 Used for visualizing the traffic data around events to understand the correlation between traffic and events.
 """
 
-from influxdb_client import InfluxDBClient
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
 
-from tools.config import INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG
+from tools.influx import get_client
 
-client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-query_api = client.query_api()
+query_api = get_client().query_api()
 
 venue = 'Etihad'
 event_query = f"""
@@ -0,0 +1,50 @@
+"""
+This script copies measurements from the live InfluxDB server into the file backend (tools/file_backend.py).
+
+The snapshot is copied one month at a time, each month is written to its own partition of the file store before the
+next one is queried, so only one month of points is held in memory. It can be re-run, points already in the file store
+are overwritten. Once taken, set INFLUXDB_BACKEND = "file" in tools/config.py to run the pipeline against it.
+"""
+
+from datetime import datetime
+
+import pandas as pd
+
+from tools.config import INFLUXDB_BUCKET, FILE_BACKEND_DIR
+from tools.file_backend import FileBackend
+from tools.influx import create_influx_client
+
+MEASUREMENTS = ["Traffic", "Event"]
+
+
+def month_ranges(start_date, end_date):
+    current = start_date
+    while current < end_date:
+        following = current.replace(year=current.year + 1, month=1) if current.month == 12 else current.replace(month=current.month + 1)
+        yield current, min(following, end_date)
+        current = following
+
+
+def snapshot(start_date, end_date, measurements=MEASUREMENTS, root=FILE_BACKEND_DIR):
+    source = create_influx_client()
+    query_api = source.query_api()
+    target = FileBackend(root)
+
+    for measurement in measurements:
+        for range_start, range_end in month_ranges(start_date, end_date):
+            query = f'''
+            from(bucket: "{INFLUXDB_BUCKET}")
+            |> range(start: {range_start.isoformat()}Z, stop: {range_end.isoformat()}Z)
+            |> filter(fn: (r) => r["_measurement"] == "{measurement}")
+            '''
+            result = query_api.query_data_frame(query)
+            frames = [df for df in (result if isinstance(result, list) else [result]) if not df.empty]
+            if frames:
+                target.write_frame(pd.concat(frames, ignore_index=True))
+            print(f"Copied {measurement} from {range_start} to {range_end}")
+
+    source.close()
+
+
+if __name__ == "__main__":
+    snapshot(datetime(2020, 12, 1), datetime(2025, 2, 1))
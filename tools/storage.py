@@ -0,0 +1,191 @@
+"""
+Storage backends of the DataLoader.
+
+A backend answers the few questions the project asks of its data, rather than arbitrary queries:
+
+    traffic(start, stop, sensors, columns)   traffic points of some or all sensors, as chunks of compact frames
+    traffic_summary(start, stop)             point count and first/last time per sensor and month (sensor catalog)
+    events(start, stop)                      events with their fields as columns
+    event_summary()                          count, total attendance and latest time of the events (event index)
+    write(records)                           points as dictionaries, {"measurement", "tags", "fields", "time"}
+
+InfluxBackend answers them with Flux queries against the InfluxDB server, FileBackend (tools/file_backend.py) from
+local parquet files, so the pipeline can run and be benchmarked without a server. get_backend() returns the backend
+selected by INFLUXDB_BACKEND in tools/config.py, shared by the whole process.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.domain.dialect import Dialect
+
+from tools.config import INFLUXDB_BACKEND, INFLUXDB_BUCKET, INFLUXDB_ORG, FILE_BACKEND_DIR
+from tools.influx import get_client
+
+STREAM_CHUNK_SIZE = 50000  # Rows per traffic chunk, bounds the memory used while a query result is read
+KEY_COLUMNS = ["platform_id", "sensor_id"]
+SUMMARY_COLUMNS = ["platform_id", "sensor_id", "sensor_type", "location", "month", "count", "first", "last"]
+RESERVED_COLUMNS = {"result", "table", "_start", "_stop", "_time", "_value", "_field", "_measurement", "value"}
+
+_backend = None
+_lock = threading.Lock()
+
+
+def traffic_frame(df, columns=None):
+    # Compact traffic frame: int64 epoch nanoseconds for _time, float32 value and categorical tags. The sensor keys are
+    # always included, columns are the other tags to keep (all of them if None).
+    if columns is None:
+        columns = [column for column in df.columns if column not in RESERVED_COLUMNS and column not in KEY_COLUMNS]
+    times = pd.to_datetime(df["_time"], utc=True).dt.tz_convert(None).astype("datetime64[ns]")
+    compact = pd.DataFrame({
+        "_time": times.to_numpy().view(np.int64),
+        "value": df["value"].to_numpy(dtype=np.float32),
+    })
+    for column in KEY_COLUMNS + [column for column in columns if column not in KEY_COLUMNS]:
+        compact[column] = pd.Categorical(df[column])
+    return compact
+
+
+def _csv_chunk(header, rows, columns):
+    df = pd.DataFrame(rows, columns=header)
+    df["value"] = pd.to_numeric(df["_value"])
+    return traffic_frame(df, columns)
+
+
+def _concat(result):
+    # query_data_frame returns a list of frames when the tables of a result have different columns
+    if isinstance(result, list):
+        return pd.concat(result, ignore_index=True) if result else pd.DataFrame()
+    return result
+
+
+def _naive_utc(times):
+    return pd.to_datetime(times, utc=True).dt.tz_convert(None)
+
+
+def _flux_time(time, default):
+    return f"{time.isoformat()}Z" if time is not None else default
+
+
+def _sensor_filter(sensors):
+    return " or ".join(f'(r["platform_id"] == "{platform_id}" and r["sensor_id"] == "{sensor_id}")'
+                       for platform_id, sensor_id in sensors)
+
+
+class InfluxBackend:
+    def __init__(self, client):
+        self.client = client
+        self.query_api = client.query_api()
+
+    def traffic(self, start_time, stop_time, sensors=None, columns=None, sensor_type="vehicle-speed", positive=True,
+                chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Traffic points of sensor_type in [start_time, stop_time), of the (platform_id, sensor_id) pairs in sensors or of
+        every sensor if None. Yields compact frames (see traffic_frame) of at most chunk_size rows with the tags in
+        columns. positive leaves out points with a value of 0 or less.
+        """
+        if sensors is not None and not sensors:
+            return
+        stages = [f'|> filter(fn: (r) => r["_measurement"] == "Traffic" and r["sensor_type"] == "{sensor_type}" and '
+                  f'r["_field"] == "value")']
+        if sensors is not None:
+            stages.append(f"|> filter(fn: (r) => {_sensor_filter(sensors)})")
+        if positive:
+            stages.append('|> filter(fn: (r) => r["_value"] > 0)')
+        if columns is not None:
+            # Only the requested tags are sent back by the server
+            keep = ", ".join(f'"{column}"' for column in ["_time", "_value"] + KEY_COLUMNS + list(columns))
+            stages.append(f"|> keep(columns: [{keep}])")
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+        |> range(start: {_flux_time(start_time, "0")}, stop: {_flux_time(stop_time, "now()")})
+        ''' + "\n        ".join(stages)
+        # The CSV response is read row by row and parsed one chunk at a time, instead of into a frame of every point
+        # and tag, so memory is bounded by the chunk size and not by the length of the time range
+        header, chunk = None, []
+        for row in self.query_api.query_csv(query, dialect=Dialect(header=True, annotations=[])):
+            if len(row) < 2:
+                continue
+            if "_time" in row and "_value" in row:
+                # A new table, its columns can differ from the previous one
+                if chunk:
+                    yield _csv_chunk(header, chunk, columns)
+                header, chunk = row, []
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield _csv_chunk(header, chunk, columns)
+                chunk = []
+        if chunk:
+            yield _csv_chunk(header, chunk, columns)
+
+    def traffic_summary(self, start_time, stop_time):
+        # Number of points with a value above 0 and the first and last of them per sensor, location and calendar month
+        base_query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+        |> range(start: {_flux_time(start_time, "0")}, stop: {_flux_time(stop_time, "now()")})
+        |> filter(fn: (r) => r["_measurement"] == "Traffic" and r["_field"] == "value")
+        |> filter(fn: (r) => r["_value"] > 0)
+        |> group(columns: ["platform_id", "sensor_id", "sensor_type", "location"])
+        |> window(every: 1mo)
+        '''
+        keys = SUMMARY_COLUMNS[:4]
+        summary = None
+        for stage, column in (("count()", "count"), ("first()", "first"), ("last()", "last")):
+            df = _concat(self.query_api.query_data_frame(base_query + f"|> {stage}"))
+            if df.empty:
+                return pd.DataFrame(columns=SUMMARY_COLUMNS)
+            values = df["_value"].astype(np.int64) if column == "count" else _naive_utc(df["_time"])
+            frame = df[keys].assign(month=_naive_utc(df["_start"]), **{column: values})
+            summary = frame if summary is None else summary.merge(frame, on=keys + ["month"])
+        return summary[SUMMARY_COLUMNS]
+
+    def events(self, start_time=None, stop_time=None):
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+        |> range(start: {_flux_time(start_time, "0")}, stop: {_flux_time(stop_time, "2100-01-01T00:00:00Z")})
+        |> filter(fn: (r) => r["_measurement"] == "Event")
+        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+        '''
+        df = _concat(self.query_api.query_data_frame(query))
+        return df.drop(columns=["result", "table", "_start", "_stop", "_measurement"], errors="ignore")
+
+    def event_summary(self):
+        # Number of points, total attendance (changes when estimates are written) and the latest time in epoch ns
+        query = f'''
+        from(bucket: "{INFLUXDB_BUCKET}")
+        |> range(start: 0, stop: 2100-01-01T00:00:00Z)
+        |> filter(fn: (r) => r["_measurement"] == "Event" and r["_field"] == "estimated_attendance")
+        |> group()
+        |> reduce(
+            identity: {{count: 0, total: 0.0, last: 0}},
+            fn: (r, accumulator) => ({{
+                count: accumulator.count + 1,
+                total: accumulator.total + float(v: r._value),
+                last: if int(v: r._time) > accumulator.last then int(v: r._time) else accumulator.last
+            }})
+        )
+        '''
+        for table in self.query_api.query(query):
+            for record in table.records:
+                return record["count"], record["total"], record["last"]
+        return 0, 0.0, 0
+
+    def write(self, records):
+        write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=list(records))
+
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            if INFLUXDB_BACKEND == "file":
+                # Only imported when the file backend is used
+                from tools.file_backend import FileBackend
+                _backend = FileBackend(FILE_BACKEND_DIR)
+            else:
+                _backend = InfluxBackend(get_client())
+        return _backend
@@ -0,0 +1,76 @@
+"""
+Local fixture server replaying Open-Meteo archive responses from recorded weather files.
+
+The fixtures use the same layout as the weather cache (<root>/<lat>_<lon>/<YYYY-MM-DD>.json), so they can be recorded
+by copying a populated cache/weather directory to WEATHER_FIXTURE_DIR. They are kept apart from the cache, which the
+weather cache writes to while it is being served. Set WEATHER_OFFLINE = True in tools/config.py to point the weather
+cache at this server.
+
+Usage: python -m tools.weather_fixture_server [fixture_root] [port]
+"""
+
+import json
+import os
+import sys
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from model.weather_cache import location_key
+from tools.config import WEATHER_FIXTURE_DIR
+
+FIXTURE_ROOT = WEATHER_FIXTURE_DIR
+PORT = 8765
+
+
+class WeatherFixtureHandler(BaseHTTPRequestHandler):
+    root = FIXTURE_ROOT
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path != "/v1/archive":
+            self._send(404, {"error": True, "reason": f"Unknown path {url.path}"})
+            return
+
+        try:
+            lat, lon = float(params["latitude"]), float(params["longitude"])
+            day = date.fromisoformat(params["start_date"])
+            end_date = date.fromisoformat(params["end_date"])
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": True, "reason": f"Invalid parameters: {e}"})
+            return
+
+        hourly = {}
+        while day <= end_date:
+            path = os.path.join(self.root, location_key(lat, lon), f"{day.isoformat()}.json")
+            if not os.path.exists(path):
+                self._send(404, {"error": True, "reason": f"No fixture for {location_key(lat, lon)} on {day}"})
+                return
+            with open(path, "r") as f:
+                for key, column in json.load(f).items():
+                    hourly.setdefault(key, []).extend(column)
+            day += timedelta(days=1)
+
+        self._send(200, {"latitude": lat, "longitude": lon, "hourly": hourly})
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(root=FIXTURE_ROOT, port=PORT):
+    WeatherFixtureHandler.root = root
+    server = ThreadingHTTPServer(("127.0.0.1", port), WeatherFixtureHandler)
+    print(f"Replaying weather fixtures from {root} on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else FIXTURE_ROOT
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    serve(root, port)